@@ -0,0 +1,168 @@
+"""Export throughput benchmarks on synthetic scenes (no Blender needed)
+
+    python benchmarks/bench_export.py --triangles 1000000 --objects 4 --slots 8 --textures 4 --json results.json
+    python benchmarks/bench_export.py --stage export_frames --textures 4 --set texture_budget=memory --set texture_budget_mb=1
+
+Reports, per stage, the wall time, triangles/sec, MB/sec written and the peak memory
+(Python/numpy allocations traced by tracemalloc, measured on a separate run).
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+import synthetic
+
+def directory_size(path):
+    total = 0
+    for (root, _, files) in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+def measure(fn, output, memory):
+    """Run fn on a clean output directory, return (seconds, bytes written, peak traced bytes)"""
+    shutil.rmtree(output, ignore_errors=True)
+    os.makedirs(output)
+    start = time.perf_counter()
+    fn()
+    seconds = time.perf_counter() - start
+    written = directory_size(output)
+
+    peak = None
+    if memory:
+        shutil.rmtree(output)
+        os.makedirs(output)
+        tracemalloc.start()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return (seconds, written, peak)
+
+def stages(render_exporter, scene, output, args):
+    """Yield (stage name, triangles processed, function)"""
+    from io_scene_render import mesh_export, mesh_bvh
+
+    mesh = scene.objects[0].mesh
+    triangles = len(mesh.loop_triangles)
+    yield ("extract_mesh", triangles, lambda: mesh_export.extract_mesh(mesh))
+
+    mesh_data = mesh_export.extract_mesh(mesh)
+    def write(mesh_format):
+        def run():
+            for i in range(args.slots):
+                shape = mesh_export.gather_shape(mesh_data, i)
+                mesh_export.write_mesh(os.path.join(output, f"shape{i}{mesh_export.MESH_EXTENSIONS[mesh_format]}"), mesh_format, *shape)
+        return run
+    yield ("write_obj", triangles, write("obj"))
+    yield ("write_binary", triangles, write("binary"))
+    yield ("write_compressed", triangles, write("compressed"))
+
+    (positions, _, _, indices) = mesh_export.gather_shape(mesh_data, 0)
+    yield ("build_bvh", len(indices), lambda: mesh_bvh.build_bvh(positions, indices))
+
+    reporter = synthetic.Reporter()
+    # Shader node linked to the output of each material
+    outputs = [next(node for node in slot.material.node_tree.nodes if node.type == 'OUTPUT_MATERIAL') for slot in scene.objects[0].material_slots]
+    material_nodes = [output.inputs[0].links[0].from_node for output in outputs]
+    def materials():
+        for (k, node) in enumerate(material_nodes):
+            render_exporter.export_material_node(reporter, scene, node, f"material{k}", output)
+        render_exporter.texture_store.close_store(os.path.join(output, "textures"))
+    yield ("export_material_node", 0, materials)
+
+    total = sum(len(o.mesh.loop_triangles) for o in scene.objects)
+    def objects():
+        render_exporter.exportedMaterials.clear()
+        render_exporter.materialCache.clear()
+        render_exporter.export_objects(reporter, output + os.sep, scene, "00001")
+        render_exporter.texture_store.close_store(os.path.join(output, "textures"))
+    yield ("export_objects", total, objects)
+
+    def frame():
+        render_exporter.materialCache.clear()
+        render_exporter.export_renderer(reporter, output + os.sep, scene, "00001")
+    yield ("export_renderer", total, frame)
+
+    # Scene file of --shapes shape entries: one json.dumps of the whole scene against the streamed writer
+    from io_scene_render import scene_writer
+    def shape_entries():
+        for k in range(args.shapes):
+            yield render_exporter.shape_entry(scene.objects[k % len(scene.objects)], 0, f"meshes/shared/{k:032x}.mesh")
+    def dumps():
+        data = {"shapes" : list(shape_entries())}
+        with open(os.path.join(output, "scene.json"), 'w') as f:
+            f.write(json.dumps(data, indent=4))
+    def streamed(compact):
+        def run():
+            with open(os.path.join(output, "scene.json"), 'w') as f:
+                writer = scene_writer.SceneWriter(f, compact)
+                shapes = writer.begin_list("shapes")
+                for entry in shape_entries():
+                    shapes.append(entry)
+                writer.end_list()
+                writer.close()
+        return run
+    yield ("scene_json_dumps", 0, dumps)
+    yield ("scene_writer", 0, streamed(False))
+    yield ("scene_writer_compact", 0, streamed(True))
+
+    # Whole export: texture budget planning, frames and manifest (export_renderer skips the budget)
+    def frames():
+        render_exporter.export_frames(reporter, output + os.sep, scene, 1, args.frames)
+    yield ("export_frames", total * args.frames, frames)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export throughput benchmarks on synthetic scenes")
+    parser.add_argument("--triangles", type=int, default=200000, help="Triangles per object")
+    parser.add_argument("--objects", type=int, default=4)
+    parser.add_argument("--slots", type=int, default=4, help="Material slots per object")
+    parser.add_argument("--textures", type=int, default=2)
+    parser.add_argument("--frames", type=int, default=1, help="Frames of the export_frames stage")
+    parser.add_argument("--shapes", type=int, default=20000, help="Shape entries of the scene file stages")
+    parser.add_argument("--set", dest="options", action="append", default=[], help="Exporter option KEY=VALUE")
+    parser.add_argument("--stage", action="append", help="Only run these stages")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="Skip the peak memory runs")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args(argv)
+
+    render_exporter = synthetic.install_stubs()
+    options = {}
+    for option in args.options:
+        (key, _, value) = option.partition("=")
+        try:
+            options[key] = json.loads(value)
+        except ValueError:
+            options[key] = value
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="io_scene_render_bench") as tmp:
+        scene = synthetic.make_scene(os.path.join(tmp, "sources"), objects=args.objects, triangles=args.triangles,
+            slots=args.slots, textures=args.textures, **options)
+        output = os.path.join(tmp, "output")
+        print(f"{'stage':<22}{'seconds':>10}{'Mtris/s':>10}{'MB/s':>10}{'MB out':>10}{'peak MB':>10}")
+        for (name, triangles, fn) in stages(render_exporter, scene, output, args):
+            if args.stage and name not in args.stage:
+                continue
+            (seconds, written, peak) = measure(fn, output, args.memory)
+            result = {
+                "stage" : name,
+                "seconds" : seconds,
+                "triangles_per_second" : triangles / seconds if seconds > 0 else None,
+                "megabytes_per_second" : written / 2**20 / seconds if seconds > 0 else None,
+                "bytes_written" : written,
+                "peak_memory" : peak
+            }
+            results.append(result)
+            rate = lambda value, scale: f"{value / scale:10.2f}" if value else f"{'-':>10}"
+            print(f"{name:<22}{seconds:10.3f}{rate(result['triangles_per_second'], 1e6)}"
+                f"{rate(result['megabytes_per_second'], 1)}{written / 2**20:10.2f}{rate(peak, 2**20)}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"arguments" : vars(args), "results" : results}, f, indent=4)
+
+if __name__ == "__main__":
+    main()
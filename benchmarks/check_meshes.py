@@ -0,0 +1,81 @@
+"""Round-trip checks of the binary and compressed mesh formats (no Blender needed)
+
+    python benchmarks/check_meshes.py
+
+Writes random meshes with various bounding boxes and position bits, reads them back and checks that
+binary meshes are lossless and that compressed meshes stay within the errors stored in their header.
+Exits with 1 if a check fails.
+"""
+import os
+import sys
+import argparse
+import tempfile
+
+import numpy as np
+
+import synthetic
+
+def random_shape(rng, vertices, center, size):
+    positions = (center + (rng.random((vertices, 3)) - 0.5) * size).astype(np.float32)
+    normals = rng.normal(size=(vertices, 3))
+    normals = (normals / np.linalg.norm(normals, axis=1, keepdims=True)).astype(np.float32)
+    uvs = rng.random((vertices, 2)).astype(np.float32)
+    indices = rng.integers(0, vertices, (2 * vertices, 3)).astype(np.uint32)
+    return (positions, normals, uvs, indices)
+
+def check_binary(mesh_export, path, shape):
+    mesh_export.write_mesh(path, "binary", *shape)
+    decoded = mesh_export.read_binary_mesh(path)
+    return [f"binary {name} differ" for (name, a, b) in zip(("positions", "normals", "uvs", "indices"), shape, decoded)
+        if not np.array_equal(a, b)]
+
+def check_compressed(mesh_export, path, shape, bits):
+    (positions, normals, uvs, indices) = shape
+    mesh_export.write_mesh(path, "compressed", *shape, position_bits=bits)
+    (dpositions, dnormals, duvs, dindices, (position_error, normal_error, uv_error)) = mesh_export.read_compressed_mesh(path)
+    failures = []
+    measured = float(np.abs(dpositions.astype(np.float64) - positions).max())
+    if measured > position_error:
+        failures.append(f"compressed{bits} position error {measured:.6g} above the header {position_error:.6g}")
+    step = float((positions.max(axis=0) - positions.min(axis=0)).max()) / ((1 << min(bits, mesh_export.MAX_POSITION_BITS)) - 1)
+    if position_error > step * 0.5 + float(np.spacing(np.abs(positions).max())):
+        failures.append(f"compressed{bits} position error {position_error:.6g} above half a step plus one ulp")
+    measured = mesh_export.angular_error(normals.astype(np.float64), dnormals.astype(np.float64))
+    if measured > normal_error:
+        failures.append(f"compressed{bits} normal error {measured:.6g} above the header {normal_error:.6g}")
+    measured = float(np.abs(duvs.astype(np.float64) - uvs).max())
+    if measured > uv_error:
+        failures.append(f"compressed{bits} uv error {measured:.6g} above the header {uv_error:.6g}")
+    if not np.array_equal(dindices, indices):
+        failures.append(f"compressed{bits} indices differ")
+    return failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Round-trip checks of the mesh formats")
+    parser.add_argument("--vertices", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    synthetic.install_stubs()
+    from io_scene_render import mesh_export
+
+    rng = np.random.default_rng(args.seed)
+    failures = []
+    cases = 0
+    with tempfile.TemporaryDirectory(prefix="io_scene_render_check") as tmp:
+        for (center, size) in ((0.0, 1.0), (0.0, 100.0), (1000.0, 100.0), (-3.5, 0.01)):
+            shape = random_shape(rng, args.vertices, center, size)
+            failures += check_binary(mesh_export, os.path.join(tmp, "shape.mesh"), shape)
+            cases += 1
+            for bits in (8, 12, 16, 20, 22, 24):
+                failures += [f"{failure} (center {center}, size {size})"
+                    for failure in check_compressed(mesh_export, os.path.join(tmp, "shape.cmesh"), shape, bits)]
+                cases += 1
+
+    for failure in failures:
+        print(failure)
+    print(f"{cases} round trips, {len(failures)} failures")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,2 @@
+def enable(module_name, default_set=False, persistent=False):
+    pass
@@ -0,0 +1,12 @@
+"""Minimal stand-in for Blender's bpy module (only what the exporter touches)"""
+from types import SimpleNamespace
+
+from . import types
+from . import props
+from . import utils
+from . import path
+
+context = SimpleNamespace(scene=None, window_manager=None, view_layer=None, evaluated_depsgraph_get=None)
+data = SimpleNamespace(filepath="", cameras=[], images=[])
+ops = SimpleNamespace(object=SimpleNamespace(mode_set=lambda mode: None))
+app = SimpleNamespace(binary_path="blender", version=(3, 2, 0))
@@ -0,0 +1,8 @@
+import os
+
+def abspath(path, start=None):
+    # Like Blender: only the '//' (blend file relative) prefix is resolved
+    if path.startswith("//"):
+        from . import data
+        return os.path.join(start or os.path.dirname(data.filepath), path[2:])
+    return path
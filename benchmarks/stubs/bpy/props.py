@@ -0,0 +1,5 @@
+def property(**options):
+    return ("property", options)
+
+BoolProperty = IntProperty = FloatProperty = StringProperty = property
+EnumProperty = PointerProperty = CollectionProperty = property
@@ -0,0 +1,17 @@
+class bpy_struct:
+    def report(self, level, message):
+        pass
+
+class RenderEngine(bpy_struct): pass
+class Operator(bpy_struct): pass
+class Panel(bpy_struct): pass
+class PropertyGroup(bpy_struct): pass
+class AddonPreferences(bpy_struct): pass
+class Header(bpy_struct): pass
+class Menu(bpy_struct): pass
+class Node(bpy_struct): pass
+class NodeSocket(bpy_struct): pass
+class NodeTree(bpy_struct): pass
+class UIList(bpy_struct): pass
+class Scene(bpy_struct): pass
+class Object(bpy_struct): pass
@@ -0,0 +1,49 @@
+"""Minimal stand-in for Blender's mathutils (Vector and 4x4 Matrix)"""
+
+class Vector(list):
+    def __init__(self, values=(0.0, 0.0, 0.0)):
+        super().__init__(float(v) for v in values)
+
+    x = property(lambda self: self[0])
+    y = property(lambda self: self[1])
+    z = property(lambda self: self[2])
+
+    def __mul__(self, scale):
+        return Vector(v * scale for v in self)
+
+    def __add__(self, other):
+        return Vector(a + b for (a, b) in zip(self, other))
+
+class MatrixColumns:
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    def __getitem__(self, j):
+        return Vector(row[j] for row in self.matrix)
+
+class Matrix(list):
+    def __init__(self, rows=None):
+        if rows is None:
+            rows = [[1.0 if i == j else 0.0 for j in range(4)] for i in range(4)]
+        super().__init__(Vector(row) for row in rows)
+
+    @classmethod
+    def Translation(cls, offset):
+        matrix = cls()
+        for i in range(3):
+            matrix[i][3] = float(offset[i])
+        return matrix
+
+    def copy(self):
+        return Matrix(self)
+
+    def transposed(self):
+        return Matrix([[self[j][i] for j in range(4)] for i in range(4)])
+
+    @property
+    def col(self):
+        return MatrixColumns(self)
+
+    @property
+    def translation(self):
+        return Vector(self[i][3] for i in range(3))
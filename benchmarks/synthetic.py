@@ -0,0 +1,253 @@
+"""Synthetic scenes for the bpy stubs: meshes, materials, textures, objects and camera"""
+import os
+import sys
+import math
+from types import SimpleNamespace
+
+import numpy as np
+
+STUBS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stubs")
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def install_stubs():
+    """Make the stub bpy/mathutils importable and return the exporter module"""
+    for path in (STUBS, REPOSITORY):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    from io_scene_render import render_exporter
+    from io_scene_render import render_panel
+    # Registers the exporter settings (with their defaults) on bpy.types.Scene
+    render_panel.register()
+    return render_exporter
+
+def default_settings():
+    """Default value of every exporter setting registered by the panel"""
+    import bpy
+    return {key : value[1].get("default") for (key, value) in vars(bpy.types.Scene).items()
+        if isinstance(value, tuple) and len(value) == 2 and value[0] == "property"}
+
+class Collection:
+    """bpy collection backed by numpy arrays (foreach_get only)"""
+
+    def __init__(self, length, **attributes):
+        self.length = length
+        self.attributes = attributes
+
+    def __len__(self):
+        return self.length
+
+    def __bool__(self):
+        return self.length != 0
+
+    def foreach_get(self, name, out):
+        out[:] = self.attributes[name].ravel()
+
+class Socket:
+    def __init__(self, identifier, default_value, links=()):
+        self.identifier = identifier
+        self.default_value = default_value
+        self.links = list(links)
+
+class Sockets(list):
+    """Node sockets, accessible by index or name"""
+
+    def __init__(self, sockets):
+        super().__init__(sockets)
+        self.by_name = {socket.identifier : socket for socket in sockets}
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.by_name[key]
+        return list.__getitem__(self, key)
+
+class Reporter:
+    """Stand-in for the export operator"""
+
+    def __init__(self):
+        self.error_or_warning = False
+        self.fatal_error = False
+        self.messages = []
+
+    def report(self, level, message):
+        self.messages.append((level, message))
+
+def node(name, bl_idname, node_type, inputs, **attributes):
+    return SimpleNamespace(name=name, bl_idname=bl_idname, type=node_type, inputs=Sockets(inputs), **attributes)
+
+def link(from_node):
+    return SimpleNamespace(from_node=from_node)
+
+def make_mesh(triangles, slots=1, uvs=True, seed=0):
+    """Height field grid of about the given number of triangles, quads randomly assigned to the slots"""
+    rng = np.random.default_rng(seed)
+    size = max(1, int(math.ceil(math.sqrt(triangles / 2))))
+    (xs, ys) = np.meshgrid(np.arange(size + 1), np.arange(size + 1), indexing='ij')
+    positions = np.stack([xs.ravel(), ys.ravel(), rng.random(xs.size)], axis=1).astype(np.float32)
+    vertex_normals = rng.normal(size=positions.shape).astype(np.float32)
+
+    (i, j) = [a.ravel() for a in np.meshgrid(np.arange(size), np.arange(size), indexing='ij')]
+    index = lambda i, j: i * (size + 1) + j
+    quads = np.stack([index(i, j), index(i + 1, j), index(i + 1, j + 1), index(i, j + 1)], axis=1)
+    loop_vertices = quads.ravel().astype(np.int32)
+    quad_loops = np.arange(len(loop_vertices), dtype=np.int32).reshape(-1, 4)
+    tri_loops = np.concatenate([quad_loops[:, [0, 1, 2]], quad_loops[:, [0, 2, 3]]], axis=1).reshape(-1, 3)
+    quad_materials = rng.integers(0, slots, len(quads)).astype(np.int32)
+
+    mesh = SimpleNamespace()
+    mesh.vertices = Collection(len(positions), co=positions)
+    mesh.loops = Collection(len(loop_vertices), vertex_index=loop_vertices, normal=vertex_normals[loop_vertices])
+    mesh.loop_triangles = Collection(len(tri_loops), loops=tri_loops, vertices=loop_vertices[tri_loops],
+        material_index=np.repeat(quad_materials, 2))
+    mesh.polygons = Collection(len(quads), material_index=quad_materials)
+    layers = []
+    if uvs:
+        layers.append(SimpleNamespace(data=Collection(len(loop_vertices), uv=(positions[:, :2] / size)[loop_vertices])))
+    mesh.uv_layers = SimpleNamespace(active=layers[0] if layers else None, layers=layers)
+    mesh.calc_loop_triangles = lambda: None
+    return mesh
+
+class Image:
+    """Image datablock (RGBA float pixels, bottom row first): copy, scale and save like Blender,
+    save writes the pixels as 8-bit values to filepath_raw"""
+
+    def __init__(self, name, filepath, width, height, pixels):
+        self.name = name
+        self.filepath = filepath
+        self.filepath_raw = filepath
+        self.file_format = 'PNG'
+        self.size = (width, height)
+        self.channels = 4
+        self.is_float = False
+        self.data = pixels
+        self.pixels = SimpleNamespace(foreach_get=lambda out: out.__setitem__(slice(None), self.data))
+
+    def copy(self):
+        return Image(self.name, self.filepath, self.size[0], self.size[1], self.data.copy())
+
+    def scale(self, width, height):
+        # Nearest neighbour
+        (source_width, source_height) = self.size
+        rows = np.arange(height) * source_height // height
+        columns = np.arange(width) * source_width // width
+        self.data = self.data.reshape(source_height, source_width, 4)[rows][:, columns].ravel()
+        self.size = (width, height)
+
+    def save(self):
+        with open(self.filepath_raw, 'wb') as f:
+            f.write((np.clip(self.data, 0.0, 1.0) * 255).astype(np.uint8).tobytes())
+
+class Images(list):
+    """bpy.data.images"""
+
+    def remove(self, image):
+        if image in self:
+            super().remove(image)
+
+def make_image(path, width, height, seed=0):
+    """Image datablock whose file is random bytes and pixels random values"""
+    rng = np.random.default_rng(seed)
+    with open(path, 'wb') as f:
+        f.write(rng.bytes(width * height))
+    pixels = rng.random(width * height * 4).astype(np.float32)
+    return Image(os.path.basename(path), path, width, height, pixels)
+
+def make_material(name, image=None):
+    """Principled material (base color textured if an image is given)"""
+    color_links = []
+    textures = []
+    if image is not None:
+        texture = node("Image Texture", "ShaderNodeTexImage", "TEX_IMAGE", [Socket("Vector", None)], image=image)
+        color_links = [link(texture)]
+        textures = [texture]
+    bsdf = node("Principled BSDF", "ShaderNodeBsdfPrincipled", "BSDF_PRINCIPLED", [
+        Socket("Base Color", (0.8, 0.8, 0.8, 1.0), color_links),
+        Socket("Metallic", 0.0),
+        Socket("Roughness", 0.5),
+        Socket("Specular", 0.5),
+        Socket("Anisotropic", 0.0),
+        Socket("Anisotropic Rotation", 0.0),
+        Socket("Transmission", 0.0),
+        Socket("Normal", (0.0, 0.0, 0.0))
+    ])
+    output = node("Material Output", "ShaderNodeOutputMaterial", "OUTPUT_MATERIAL", [Socket("Surface", None, [link(bsdf)])])
+    return SimpleNamespace(name=name, use_nodes=True, node_tree=SimpleNamespace(nodes=textures + [bsdf, output]))
+
+def make_emission_material(name, strength=10.0):
+    """Emission material of uniform radiance"""
+    emission = node("Emission", "ShaderNodeEmission", "EMISSION", [Socket("Color", (1.0, 0.9, 0.8, 1.0)), Socket("Strength", strength)])
+    output = node("Material Output", "ShaderNodeOutputMaterial", "OUTPUT_MATERIAL", [Socket("Surface", None, [link(emission)])])
+    return SimpleNamespace(name=name, use_nodes=True, node_tree=SimpleNamespace(nodes=[emission, output]))
+
+class MeshObject:
+    def __init__(self, name, mesh, materials, matrix):
+        from mathutils import Matrix
+        self.name = name
+        self.type = 'MESH'
+        self.hide_render = False
+        self.mesh = mesh
+        self.data = SimpleNamespace(name=name, name_full=name, users=1, shape_keys=None, update=lambda: None, as_pointer=lambda: id(self.mesh))
+        self.modifiers = []
+        self.material_slots = [SimpleNamespace(material=material) for material in materials]
+        self.matrix_world = Matrix(matrix)
+        positions = mesh.vertices.attributes["co"]
+        (lower, upper) = (positions.min(axis=0), positions.max(axis=0))
+        self.bound_box = [(x, y, z) for x in (lower[0], upper[0]) for y in (lower[1], upper[1]) for z in (lower[2], upper[2])]
+
+    def evaluated_get(self, depsgraph):
+        return SimpleNamespace(to_mesh=lambda: self.mesh, to_mesh_clear=lambda: None)
+
+    # Evaluated object API (instances of the depsgraph)
+    def to_mesh(self):
+        return self.mesh
+
+    def to_mesh_clear(self):
+        pass
+
+def make_instances(source, count, seed=0):
+    """Depsgraph instances of source scattered on a plane (like a particle system)"""
+    from mathutils import Matrix
+    rng = np.random.default_rng(seed)
+    offsets = rng.random((count, 3)) * (100, 100, 0)
+    return [SimpleNamespace(is_instance=True, object=source, matrix_world=Matrix.Translation(offset)) for offset in offsets]
+
+def make_scene(directory, objects=4, triangles=100000, slots=2, textures=2, texture_size=256, instances=0, emitters=0, **options):
+    """Build a scene, install it as bpy.context.scene and return it
+    (triangles is the count per object, instances the number of depsgraph instances of a small mesh,
+    emitters the number of slots with an emission material, options override the exporter settings)"""
+    import bpy
+    from mathutils import Matrix
+
+    os.makedirs(directory, exist_ok=True)
+    images = [make_image(os.path.join(directory, f"texture{k}.png"), texture_size, texture_size, seed=k) for k in range(textures)]
+    materials = [make_emission_material(f"emission{k}") if k < emitters else make_material(f"material{k}", images[k % textures] if textures else None)
+        for k in range(slots)]
+    scene_objects = [MeshObject(f"object{k}", make_mesh(triangles, slots, seed=k), materials, Matrix.Translation((k, 0, 0)))
+        for k in range(objects)]
+
+    camera = SimpleNamespace(name="Camera", type='CAMERA', data=SimpleNamespace(angle=0.8),
+        matrix_world=Matrix.Translation((0, 0, 10)))
+    background = node("Background", "ShaderNodeBackground", "BACKGROUND", [Socket("Color", (0.1, 0.1, 0.1, 1.0)), Socket("Strength", 1.0)])
+    world_output = node("World Output", "ShaderNodeOutputWorld", "OUTPUT_WORLD", [Socket("Surface", None, [link(background)])])
+
+    scene = SimpleNamespace(
+        objects=scene_objects, camera=camera, frame_current=1,
+        world=SimpleNamespace(node_tree=SimpleNamespace(nodes=[background, world_output])),
+        render=SimpleNamespace(resolution_x=1366, resolution_y=768))
+    settings = default_settings()
+    settings.update(options)
+    for (key, value) in settings.items():
+        setattr(scene, key, value)
+    scene.frame_set = lambda frame: setattr(scene, "frame_current", frame)
+
+    bpy.context.scene = scene
+    bpy.context.window_manager = SimpleNamespace(progress_begin=lambda a, b: None,
+        progress_update=lambda value: None, progress_end=lambda: None)
+    bpy.context.view_layer = SimpleNamespace(update=lambda: None)
+    scatter = MeshObject("scatter", make_mesh(200, slots, seed=objects), materials, Matrix())
+    object_instances = [SimpleNamespace(is_instance=False, object=o, matrix_world=o.matrix_world) for o in scene_objects]
+    object_instances += make_instances(scatter, instances)
+    bpy.context.evaluated_depsgraph_get = lambda: SimpleNamespace(object_instances=object_instances)
+    bpy.data.filepath = os.path.join(directory, "synthetic.blend")
+    bpy.data.cameras = [camera.data]
+    bpy.data.images = Images(images)
+    return scene
@@ -0,0 +1,287 @@
+"""Command line batch export
+
+Run from a shell (the frames are split across worker Blender processes):
+    python io_scene_render/batch_export.py shot.blend --frames 1-1000 --output /farm/shot --workers 8 --set mesh_format=binary
+
+or from Blender itself:
+    blender -b shot.blend --python-expr "from io_scene_render import batch_export; batch_export.main()" -- --frames 1-1000 --output /farm/shot
+
+Exit code: 0 export complete, 1 warnings, 2 errors (fatal export error or failed worker).
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+try:
+    from . import export_manifest
+    from . import export_metrics
+except ImportError:
+    # Run as a script from the add-on directory
+    import export_manifest
+    import export_metrics
+
+WORKER_EXPR = "from io_scene_render import batch_export; batch_export.worker_main()"
+QUERY_EXPR = "from io_scene_render import batch_export; batch_export.query_main()"
+# Prefix of the line printed by query_main
+QUERY_PREFIX = "io_scene_render batch settings: "
+
+EXIT_OK = 0
+EXIT_WARNING = 1
+EXIT_ERROR = 2
+
+class BatchReporter:
+    """Stand-in for the export operator: collects the reports of the exporter"""
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.error_or_warning = False
+        self.fatal_error = False
+        self.messages = []
+
+    def report(self, level, message):
+        if 'ERROR' in level or 'WARNING' in level:
+            self.messages.append(f"{'ERROR' if 'ERROR' in level else 'WARNING'}: {message}")
+            print(self.messages[-1])
+        elif self.verbose:
+            print(message)
+
+def script_arguments(argv):
+    """Return the arguments given to the script (after '--' when running inside Blender)"""
+    if argv is None:
+        argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+    return argv
+
+def frame_range(text):
+    (start, _, end) = text.partition("-")
+    return (int(start), int(end or start))
+
+def option_value(text):
+    (key, _, value) = text.partition("=")
+    try:
+        value = json.loads(value)
+    except ValueError:
+        pass
+    return (key, value)
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description="Export a Blender scene for the renderer")
+    parser.add_argument("blend", nargs="?", help="Blender file (default: the file opened in Blender)")
+    parser.add_argument("--frames", type=frame_range, help="Frame range START-END (default: scene batch range)")
+    parser.add_argument("--output", help="Output directory (default: scene export path)")
+    parser.add_argument("--workers", type=int, default=1, help="Number of Blender worker processes")
+    parser.add_argument("--blender", help="Blender executable (default: the running Blender, or 'blender')")
+    parser.add_argument("--set", dest="options", type=option_value, action="append", default=[],
+                        help="Exporter option KEY=VALUE (scene property, e.g. mesh_format=binary)")
+    parser.add_argument("--verbose", action="store_true", help="Print all the exporter messages")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--report", help=argparse.SUPPRESS)
+    parser.add_argument("--metrics", help=argparse.SUPPRESS)
+    parser.add_argument("--manifest", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def split_frames(start, end, workers):
+    """Split the frame range in contiguous chunks (keeps the cross-frame caches useful)"""
+    nb_frames = end - start + 1
+    workers = max(1, min(workers, nb_frames))
+    chunks = []
+    for k in range(workers):
+        first = start + k * nb_frames // workers
+        last = start + (k + 1) * nb_frames // workers - 1
+        chunks.append((first, last))
+    return chunks
+
+def open_scene(args):
+    """Enable the add-on and apply the options to the scene opened in this Blender, return it"""
+    import bpy
+    import addon_utils
+    addon_utils.enable("io_scene_render", default_set=False)
+
+    scene = bpy.context.scene
+    for (key, value) in args.options:
+        setattr(scene, key, value)
+    return scene
+
+def scene_settings(args, scene):
+    """Frame range and output directory of the export (the scene ones if not given)"""
+    import bpy
+    frames = args.frames or (scene.batch_frame_start, scene.batch_frame_end)
+    return (frames, args.output or bpy.path.abspath(scene.exportpath))
+
+def query_main(argv=None):
+    """Entry point of the Blender process queried by the driver for the scene frame range and output"""
+    args = parse_arguments(script_arguments(argv))
+    ((start, end), output) = scene_settings(args, open_scene(args))
+    print(QUERY_PREFIX + json.dumps({"frames" : [start, end], "output" : output}))
+
+def query_scene(blender, blend, args):
+    """Return the frame range and output directory saved in the blend file (None if the query failed)"""
+    command = [blender, "-b", blend, "--python-expr", QUERY_EXPR, "--"]
+    for (key, value) in args.options:
+        command += ["--set", f"{key}={json.dumps(value)}"]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    for line in result.stdout.splitlines():
+        if line.startswith(QUERY_PREFIX):
+            settings = json.loads(line[len(QUERY_PREFIX):])
+            return (tuple(settings["frames"]), settings["output"])
+    print(result.stdout)
+    return None
+
+def export(args):
+    """Export args.frames from the scene opened in this Blender, return the report"""
+    from io_scene_render import render_exporter
+
+    scene = open_scene(args)
+    ((start, end), output) = scene_settings(args, scene)
+
+    if args.verbose:
+        scene.verbose_log = True
+
+    parent = BatchReporter(args.verbose)
+    summary = ""
+    if args.worker and args.workers > 1 and scene.export_animation:
+        # Each worker would write its own base scene and tracks to the same animation.json
+        parent.report({'ERROR'}, "Animation tracks cannot be split across several workers (use --workers 1)")
+        parent.error_or_warning = True
+        parent.fatal_error = True
+    else:
+        try:
+            summary = render_exporter.export_frames(parent, output, scene, start, end, args.metrics, args.manifest).summary()
+            print(summary)
+        except Exception as e:
+            parent.report({'ERROR'}, f"Export failed: {e!r}")
+            parent.error_or_warning = True
+            parent.fatal_error = True
+    return {
+        "frames" : [start, end],
+        "error_or_warning" : parent.error_or_warning,
+        "fatal_error" : parent.fatal_error,
+        "summary" : summary,
+        "messages" : parent.messages
+    }
+
+def exit_code(report):
+    if report["fatal_error"]:
+        return EXIT_ERROR
+    return EXIT_WARNING if report["error_or_warning"] else EXIT_OK
+
+def worker_main(argv=None):
+    """Entry point of a worker Blender process"""
+    args = parse_arguments(script_arguments(argv))
+    report = export(args)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f)
+    sys.exit(exit_code(report))
+
+def main(argv=None):
+    """Entry point of the batch export (fans the frames out to worker processes)"""
+    args = parse_arguments(script_arguments(argv))
+    try:
+        import bpy
+    except ImportError:
+        bpy = None
+
+    # Single process inside Blender: export directly
+    if bpy is not None and args.workers <= 1 and not args.blend:
+        report = export(args)
+        print(f"Export {'complete' if exit_code(report) == EXIT_OK else 'finished with issues'}: frames {report['frames'][0]}-{report['frames'][1]}")
+        sys.exit(exit_code(report))
+
+    blend = args.blend or (bpy.data.filepath if bpy is not None else None)
+    blender = args.blender or (bpy.app.binary_path if bpy is not None else "blender")
+    if not blend:
+        print("A blend file is required")
+        sys.exit(EXIT_ERROR)
+    if not args.frames or not args.output:
+        # Default to the settings saved in the scene
+        settings = query_scene(blender, blend, args)
+        if settings is None:
+            print(f"Could not read the frame range and output directory of {blend} (use --frames and --output)")
+            sys.exit(EXIT_ERROR)
+        args.frames = args.frames or settings[0]
+        args.output = args.output or settings[1]
+    if not args.output:
+        print("An output directory (--output or the scene export path) is required")
+        sys.exit(EXIT_ERROR)
+
+    chunks = split_frames(args.frames[0], args.frames[1], args.workers)
+    if len(chunks) > 1 and dict(args.options).get("export_animation", False):
+        print("Animation tracks cannot be split across several workers (use --workers 1)")
+        sys.exit(EXIT_ERROR)
+
+    # Worker logs and reports are kept next to the export
+    output = os.path.abspath(args.output)
+    logs = os.path.join(output, "logs")
+    os.makedirs(logs, exist_ok=True)
+    # A mesh file unused by the frames of a worker can be used by the frames of another one:
+    # the workers save the manifest of their frames in logs, merged into export_manifest.json once they are all done
+    # (and only then the unused files are removed)
+    previous = export_manifest.load(output)
+    prune = dict(args.options).get("prune_meshes", True)
+    workers = []
+    for (k, (start, end)) in enumerate(chunks):
+        report = os.path.join(logs, f"worker{k}.json")
+        metrics = os.path.join(logs, f"metrics{k}.json")
+        manifest = os.path.join(logs, f"manifest{k}.json")
+        for path in (report, metrics, manifest):
+            if os.path.exists(path):
+                os.remove(path)
+        # The metrics of each worker are merged into metrics.json once they are all done
+        command = [blender, "-b", blend, "--python-expr", WORKER_EXPR, "--",
+            "--worker", "--workers", str(len(chunks)), "--frames", f"{start}-{end}", "--output", output + os.sep,
+            "--report", report, "--metrics", metrics, "--manifest", manifest]
+        for (key, value) in args.options:
+            command += ["--set", f"{key}={json.dumps(value)}"]
+        command += ["--set", "prune_meshes=false"]
+        if args.verbose:
+            command.append("--verbose")
+        log = open(os.path.join(logs, f"worker{k}.log"), 'w')
+        print(f"Worker {k}: frames {start}-{end}")
+        workers.append((subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT), log, report, metrics, manifest, (start, end)))
+
+    # Combine the worker reports
+    combined = {"error_or_warning" : False, "fatal_error" : False, "messages" : []}
+    metrics_reports = []
+    manifests = []
+    for (k, (process, log, report, metrics, manifest, (start, end))) in enumerate(workers):
+        returncode = process.wait()
+        log.close()
+        if os.path.exists(metrics):
+            with open(metrics) as f:
+                metrics_reports.append(json.load(f))
+        if os.path.exists(manifest):
+            manifests.append(manifest)
+        if os.path.exists(report):
+            with open(report) as f:
+                result = json.load(f)
+        else:
+            result = {"error_or_warning" : True, "fatal_error" : True,
+                "messages" : [f"ERROR: worker exited with code {returncode} without report (see {log.name})"]}
+        combined["error_or_warning"] |= result["error_or_warning"]
+        combined["fatal_error"] |= result["fatal_error"]
+        combined["messages"] += [f"[frames {start}-{end}] {message}" for message in result["messages"]]
+        print(f"Worker {k}: frames {start}-{end} {['complete', 'warnings', 'errors'][exit_code(result)]} {result.get('summary', '')}")
+
+    if len(metrics_reports) != 0:
+        with open(os.path.join(output, "metrics.json"), 'w') as f:
+            json.dump(export_metrics.merge_reports(metrics_reports), f, indent=4)
+
+    # Frames completed by the workers, failed ones included
+    export_manifest.merge(output, manifests)
+    if prune and not combined["fatal_error"]:
+        removed = export_manifest.prune(output, previous)
+        if len(removed) != 0:
+            print(f"Removed {len(removed)} mesh files not used anymore")
+
+    for message in combined["messages"]:
+        print(message)
+    with open(os.path.join(logs, "report.json"), 'w') as f:
+        json.dump(combined, f, indent=4)
+    code = exit_code(combined)
+    print(["Export complete.", "Export generated warnings (please check log).", "Export failed (please check log)."][code])
+    sys.exit(code)
+
+if __name__ == "__main__":
+    main()
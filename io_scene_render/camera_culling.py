@@ -0,0 +1,75 @@
+import math
+import numpy as np
+
+def object_corners(object):
+    """World space corners of the object bounding box (8 x 3)"""
+    corners = np.ones((8, 4))
+    corners[:, :3] = np.array([tuple(corner) for corner in object.bound_box], dtype=np.float64)
+    return (np.array(object.matrix_world, dtype=np.float64) @ corners.T).T[:, :3]
+
+def local_size(object):
+    """Diagonal of the object bounding box in object space"""
+    corners = np.array([tuple(corner) for corner in object.bound_box], dtype=np.float64)
+    return float(np.linalg.norm(corners.max(axis=0) - corners.min(axis=0)))
+
+class CameraFrustum:
+    """Camera frustum (with the field of view of export_camera) to test object bounding boxes against"""
+
+    def __init__(self, camera, resolution_x, resolution_y, margin=0.0):
+        self.world_to_camera = np.linalg.inv(np.array(camera.matrix_world, dtype=np.float64))
+        # Same horizontal / vertical field of view as the exported camera
+        angle = camera.data.angle
+        tan_x = math.tan(angle * 0.5)
+        tan_y = math.tan(angle * (resolution_y / resolution_x) * 0.5)
+        # The margin enlarges the field of view (fraction of its size)
+        self.tan_x = tan_x * (1 + margin)
+        self.tan_y = tan_y * (1 + margin)
+        self.pixels_per_unit = resolution_x / (2 * tan_x)
+
+    def camera_space(self, corners):
+        """Camera space (x, y) and depth along the view direction of the corners"""
+        points = corners @ self.world_to_camera[:3, :3].T + self.world_to_camera[:3, 3]
+        return (points[:, 0], points[:, 1], -points[:, 2])
+
+    def inside(self, corners):
+        """False if the box lies fully outside one of the frustum planes (conservative)"""
+        (x, y, depth) = self.camera_space(corners)
+        outside = ((depth <= 0).all()
+            or (x > self.tan_x * depth).all() or (x < -self.tan_x * depth).all()
+            or (y > self.tan_y * depth).all() or (y < -self.tan_y * depth).all())
+        return not outside
+
+    def screen_size(self, corners):
+        """Projected diameter (pixels) of the sphere bounding the box, infinite if the camera is inside it"""
+        center = corners.mean(axis=0)
+        radius = float(np.linalg.norm(corners - center, axis=1).max())
+        (_, _, depth) = self.camera_space(center[None, :])
+        if depth[0] <= radius:
+            return math.inf
+        return 2 * radius / depth[0] * self.pixels_per_unit
+
+def camera_frustum(scene, margin=0.0):
+    """Return the frustum of the scene camera (None without camera)"""
+    camera = scene.camera
+    if camera is None or camera.type != 'CAMERA':
+        return None
+    return CameraFrustum(camera, scene.resolution_x, scene.resolution_y, margin)
+
+def range_visibility(scene, frame_start, frame_end, margin=0.0):
+    """Visibility of the mesh objects over a frame range (sets the frames of the range):
+    {object name : (inside the frustum at one frame at least, largest screen size)}"""
+    visibility = {}
+    for frame in range(frame_start, frame_end + 1):
+        scene.frame_set(frame)
+        frustum = camera_frustum(scene, margin)
+        for object in scene.objects:
+            if object.type != 'MESH':
+                continue
+            if frustum is None:
+                # No camera at this frame: nothing can be culled
+                visibility[object.name] = (True, math.inf)
+                continue
+            corners = object_corners(object)
+            (inside, pixels) = visibility.get(object.name, (False, 0.0))
+            visibility[object.name] = (inside or frustum.inside(corners), max(pixels, frustum.screen_size(corners)))
+    return visibility
@@ -0,0 +1,115 @@
+import os
+import json
+
+# Shapes exported per frame and object, with the fingerprint of what produced them
+# (kept in the output directory, no bpy: also used by the batch export driver)
+MANIFEST = "export_manifest.json"
+MANIFEST_VERSION = 2
+
+manifests = {}
+
+def read(path):
+    """Return the frames of a manifest file ({} if none)"""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        data = json.load(f)
+    if data.get("version") != MANIFEST_VERSION:
+        return {}
+    return data["frames"]
+
+def save(path, frames):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump({"version" : MANIFEST_VERSION, "frames" : frames}, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+def load(directory):
+    """Return the frames of the manifest saved in directory ({} if none)"""
+    return read(os.path.join(directory, MANIFEST))
+
+def merge(directory, paths):
+    """Add the frames of the manifest files (e.g. saved by batch workers) to the manifest of directory"""
+    frames = load(directory)
+    for path in paths:
+        frames.update(read(path))
+    save(os.path.join(directory, MANIFEST), frames)
+
+def referenced_files(frames):
+    """Paths (relative to the output directory) of the mesh files and their sidecars used by the frames"""
+    files = set()
+    for objects in frames.values():
+        for entry in objects.values():
+            for (_, filename, sidecars) in entry["shapes"]:
+                files.add(filename)
+                files.update(sidecars.values())
+    return files
+
+def prune(directory, previous):
+    """Remove the files referenced by the previous frames but not by the saved manifest, return them"""
+    removed = []
+    for filename in sorted(referenced_files(previous) - referenced_files(load(directory))):
+        path = os.path.join(directory, filename)
+        if os.path.exists(path):
+            os.remove(path)
+            removed.append(filename)
+    return removed
+
+class ExportManifest:
+    """Fingerprint and files of the shapes of each (frame, object) exported in a directory"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.frames = load(directory)
+        # Frames exported by this export (replace the saved ones on close)
+        self.updated = {}
+        self.pending = {}
+
+    def lookup(self, frame, name, fingerprint):
+        """Return the shapes [(slot, filename, {sidecar : filename})] of an unchanged object whose files all exist (None otherwise)"""
+        entry = self.frames.get(frame, {}).get(name)
+        if entry is None or entry["fingerprint"] != fingerprint:
+            return None
+        shapes = [tuple(shape) for shape in entry["shapes"]]
+        for (_, filename, sidecars) in shapes:
+            for path in (filename, *sidecars.values()):
+                if not os.path.exists(os.path.join(self.directory, path)):
+                    return None
+        return shapes
+
+    def record(self, frame, name, fingerprint, shapes):
+        self.pending.setdefault(frame, {})[name] = {"fingerprint" : fingerprint, "shapes" : [list(shape) for shape in shapes]}
+
+    def commit_frame(self, frame):
+        """The frame is complete: its objects replace the ones previously saved (removed objects are forgotten)"""
+        self.updated[frame] = self.pending.pop(frame, {})
+
+    def close(self, prune_files=True, path=None):
+        """Save the manifest, then remove the files no longer referenced (if prune_files), return them
+
+        With path, only the frames of this export are saved there (to be merged later, see merge)
+        and the manifest of the directory is left as is."""
+        if path is not None:
+            save(path, self.updated)
+            return []
+        # Merge with the frames saved meanwhile by other exports
+        previous = load(self.directory)
+        frames = dict(previous)
+        frames.update(self.updated)
+        save(os.path.join(self.directory, MANIFEST), frames)
+        if not prune_files:
+            return []
+        return prune(self.directory, previous)
+
+def open_manifest(directory):
+    """Return the manifest of the output directory (shared by the frames of an export)"""
+    key = os.path.realpath(directory)
+    if key not in manifests:
+        manifests[key] = ExportManifest(directory)
+    return manifests[key]
+
+def close_manifest(directory, prune_files=True, path=None):
+    manifest = manifests.pop(os.path.realpath(directory), None)
+    if manifest is None:
+        return []
+    return manifest.close(prune_files, path)
@@ -0,0 +1,179 @@
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+
+# Per-item messages (objects, files, textures...) are only reported when verbose
+verbose = False
+
+# Metrics of the running export (None outside of export_frames)
+current = None
+
+def log(parent, message, level={'INFO'}):
+    """Report a per-item message (dropped unless the verbose log is enabled)"""
+    if verbose:
+        parent.report(level, message)
+
+def memory_usage():
+    """Return the (current, peak) resident memory of the process in MB (None when unknown)"""
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t)
+            ]
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return (None, None)
+        return (counters.WorkingSetSize / 2**20, counters.PeakWorkingSetSize / 2**20)
+
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, in KB elsewhere
+    peak = peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+    current = None
+    try:
+        with open("/proc/self/statm") as statm:
+            current = int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        pass
+    return (current, peak)
+
+def format_memory(usage):
+    (current, peak) = usage
+    text = "unknown" if current is None else f"{current:.0f} MB"
+    return text + (f" (peak {peak:.0f} MB)" if peak is not None else "")
+
+class ExportMetrics:
+    """Wall time per export phase, per-object triangle counts, culled objects, texture resolutions and bytes written"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.stack = []
+        self.frames = []
+        self.objects = {}
+        self.culled = []
+        self.textures = {}
+        self.bytes_written = 0
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """Time a phase of the main thread (nested phases are not counted twice)"""
+        start = time.perf_counter()
+        self.stack.append(name)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stack.pop()
+            self.add_time(name, elapsed)
+            if self.stack:
+                self.add_time(self.stack[-1], -elapsed)
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def add_frame(self, frame, seconds):
+        self.frames.append({"frame" : frame, "seconds" : seconds})
+
+    def add_object(self, name, triangles):
+        self.objects.setdefault(name, {"triangles" : 0, "bytes" : 0})["triangles"] = triangles
+
+    def add_culled(self, frame, name, action, reason):
+        """Account an object skipped or decimated by the camera culling"""
+        self.culled.append({"frame" : frame, "name" : name, "action" : action, "reason" : reason})
+
+    def add_texture(self, name, source_size, size, reason):
+        """Account the resolution chosen for a texture by the texture budget"""
+        self.textures[name] = {"source" : list(source_size), "exported" : list(size), "reason" : reason}
+
+    def add_file(self, name, path):
+        """Account a written file (called from the writer threads)"""
+        size = os.path.getsize(path)
+        with self.lock:
+            self.bytes_written += size
+            if name is not None:
+                self.objects.setdefault(name, {"triangles" : 0, "bytes" : 0})["bytes"] += size
+
+    def report(self):
+        return {
+            "wall_time" : time.perf_counter() - self.start,
+            "phases" : self.phases,
+            "frames" : self.frames,
+            "bytes_written" : self.bytes_written,
+            "memory" : dict(zip(("current_mb", "peak_mb"), memory_usage())),
+            "objects" : self.objects,
+            "culled" : self.culled,
+            "textures" : self.textures
+        }
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=4)
+
+    def summary(self):
+        report = self.report()
+        phases = sorted(report["phases"].items(), key=lambda item: -item[1])
+        text = ", ".join(f"{name} {seconds:.1f}s" for (name, seconds) in phases[:5])
+        return (f"Export took {report['wall_time']:.1f}s ({text}), {len(self.objects)} objects, "
+            f"{sum(o['triangles'] for o in self.objects.values())} triangles, {self.bytes_written / 2**20:.1f} MB written")
+
+def merge_reports(reports):
+    """Combine the reports of exports of different frame ranges into the same directory
+    (batch workers): times and sizes add up, the wall time and memory are the largest ones"""
+    merged = {"wall_time" : 0.0, "phases" : {}, "frames" : [], "bytes_written" : 0,
+        "memory" : {"current_mb" : None, "peak_mb" : None}, "objects" : {}, "culled" : [], "textures" : {}}
+    largest = lambda a, b: b if a is None else a if b is None else max(a, b)
+    for report in reports:
+        merged["wall_time"] = max(merged["wall_time"], report["wall_time"])
+        for (name, seconds) in report["phases"].items():
+            merged["phases"][name] = merged["phases"].get(name, 0.0) + seconds
+        merged["frames"] += report["frames"]
+        merged["bytes_written"] += report["bytes_written"]
+        for key in ("current_mb", "peak_mb"):
+            merged["memory"][key] = largest(merged["memory"][key], report["memory"][key])
+        for (name, counts) in report["objects"].items():
+            entry = merged["objects"].setdefault(name, {"triangles" : 0, "bytes" : 0})
+            entry["triangles"] = max(entry["triangles"], counts["triangles"])
+            entry["bytes"] += counts["bytes"]
+        merged["culled"] += report["culled"]
+        merged["textures"].update(report["textures"])
+    merged["frames"].sort(key=lambda frame: frame["frame"])
+    return merged
+
+def start_export(verbose_log):
+    """Start collecting the metrics of an export"""
+    global current, verbose
+    verbose = verbose_log
+    current = ExportMetrics()
+    return current
+
+def stop_export():
+    global current
+    metrics = current
+    current = None
+    return metrics
+
+def phase(name):
+    """Time a phase of the running export (no-op outside of an export)"""
+    if current is None:
+        return nullcontext()
+    return current.phase(name)
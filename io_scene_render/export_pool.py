@@ -0,0 +1,70 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+class ExportPipeline:
+    """Write the mesh files on a thread pool while the main thread keeps evaluating objects
+    (bpy is only touched by the main thread, the workers only see numpy arrays)"""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.files = set()
+        self.futures = []
+        self.lock = threading.Lock()
+        self.write_time = 0.0
+        self.wait_time = 0.0
+        self.start = time.perf_counter()
+        self.executor = None
+        if workers > 0:
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="io_scene_render")
+            # Bound the number of pending shapes (and so the memory held by their buffers)
+            self.pending = threading.BoundedSemaphore(2 * workers)
+
+    def run(self, fn, args):
+        start = time.perf_counter()
+        try:
+            fn(*args)
+        finally:
+            with self.lock:
+                self.write_time += time.perf_counter() - start
+            if self.executor is not None:
+                self.pending.release()
+
+    def write(self, path, fn, *args):
+        """Schedule fn(*args) that writes path"""
+        self.files.add(path)
+        if self.executor is None:
+            self.run(fn, args)
+            return
+        start = time.perf_counter()
+        self.pending.acquire()
+        self.wait_time += time.perf_counter() - start
+        self.futures.append(self.executor.submit(self.run, fn, args))
+
+    def cancel(self):
+        """Drop the writes not started yet and wait for the running ones"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def close(self):
+        """Wait for all the writes (re-raise the first error), return the pipeline statistics"""
+        if self.executor is not None:
+            start = time.perf_counter()
+            self.executor.shutdown(wait=True)
+            self.wait_time += time.perf_counter() - start
+            for future in self.futures:
+                future.result()
+        wall = time.perf_counter() - self.start
+
+        # Fraction of the writing time hidden behind the main thread work
+        overlap = 0.0
+        if self.executor is not None and self.write_time > 0.0:
+            overlap = max(0.0, self.write_time - self.wait_time) / self.write_time
+        return {
+            "workers" : self.workers,
+            "files" : len(self.files),
+            "write_time" : self.write_time,
+            "wait_time" : self.wait_time,
+            "wall_time" : wall,
+            "overlap" : min(overlap, 1.0)
+        }
@@ -0,0 +1,167 @@
+import os
+import math
+import struct
+import numpy as np
+
+from . import mesh_export
+from . import texture_bake
+
+# Emitter sampling tables (little-endian)
+#   triangle CDF, next to the mesh file (<mesh>.cdf):
+#     header: magic, version, triangle count, total area (object space, float32)
+#     cdf: float32 per triangle, in the order of the mesh file, the last value is 1
+#   scene emitter table (lights/<frame>.emitters):
+#     header: magic, version, emitter count, total power (float32)
+#     shape index (uint32, in the scene shapes), power (float32) and cdf (float32) of each emitter
+#   envmap distribution, next to the copied envmap (<texture>_<width>x<height>.envcdf):
+#     header: magic, version, grid width, grid height, integral of the weights over the grid (float32)
+#     marginal cdf over the rows (float32 x height), then the cdf of each row (float32 x width x height)
+#     rows go from top (theta = 0) to bottom, the weight of a cell is its mean luminance x sin(theta)
+CDF_MAGIC = b"MTILCDF\0"
+EMITTERS_MAGIC = b"MTIEMIT\0"
+ENVMAP_MAGIC = b"MTIENVS\0"
+SAMPLING_VERSION = 1
+SAMPLING_HEADER = struct.Struct("<8sIIf")
+ENVMAP_HEADER = struct.Struct("<8sIIIf")
+CDF_EXTENSION = ".cdf"
+ENVMAP_EXTENSION = ".envcdf"
+
+def cdf_filename(filename):
+    """Name of the triangle CDF sidecar of a mesh file"""
+    return os.path.splitext(filename)[0] + CDF_EXTENSION
+
+def envmap_filename(filename, width, height):
+    """Name of the sampling distribution sidecar of an envmap for a given grid"""
+    return f"{os.path.splitext(filename)[0]}_{width}x{height}{ENVMAP_EXTENSION}"
+
+def luminance(value):
+    """Luminance of an exported radiance (value, color or texture: its scale, checkerboards: the mean of the colors)"""
+    if isinstance(value, dict):
+        scale = value.get("scale", 1.0)
+        if "color1" in value:
+            return 0.5 * (luminance(value["color1"]) + luminance(value["color2"])) * luminance(scale)
+        return luminance(scale)
+    if isinstance(value, (list, tuple)):
+        return 0.2126 * value[0] + 0.7152 * value[1] + 0.0722 * value[2]
+    return float(value)
+
+def triangle_areas(positions, indices):
+    triangles = positions[indices].astype(np.float64)
+    return 0.5 * np.linalg.norm(np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]), axis=1)
+
+def slot_area(mesh_data, material_index, matrix=None):
+    """Area of the triangles using material_index (in world space with the 4x4 matrix)"""
+    tri_loops = mesh_data["tri_loops"][mesh_export.material_triangles(mesh_data, material_index)]
+    positions = mesh_data["positions"][mesh_data["loop_vertices"][tri_loops.ravel()]].astype(np.float64)
+    if matrix is not None:
+        matrix = np.array(matrix, dtype=np.float64)
+        positions = positions @ matrix[:3, :3].T + matrix[:3, 3]
+    return float(triangle_areas(positions, np.arange(len(positions)).reshape(-1, 3)).sum())
+
+def area_scales(matrices):
+    """Approximate area scale of each 4x4 matrix (exact for uniform scales)"""
+    return np.abs(np.linalg.det(matrices[:, :3, :3].astype(np.float64))) ** (2.0 / 3.0)
+
+def emitted_power(radiance, area):
+    """Power of a diffuse emitter of uniform radiance"""
+    return math.pi * luminance(radiance) * area
+
+def normalized_cdf(weights):
+    cdf = np.cumsum(weights, dtype=np.float64)
+    total = cdf[-1] if len(cdf) else 0.0
+    if total > 0:
+        cdf /= total
+    else:
+        cdf = np.arange(1, len(weights) + 1, dtype=np.float64) / max(len(weights), 1)
+    return (cdf.astype("<f4"), total)
+
+def write_triangle_cdf(file, positions, indices):
+    """Write the area CDF of the triangles (the file appears only once complete)"""
+    (cdf, total) = normalized_cdf(triangle_areas(positions, indices))
+    tmp = mesh_export.temporary_path(file)
+    with open(tmp, 'wb') as out:
+        out.write(SAMPLING_HEADER.pack(CDF_MAGIC, SAMPLING_VERSION, len(cdf), total))
+        out.write(cdf.tobytes())
+    os.replace(tmp, file)
+
+def write_emitter_table(file, emitters):
+    """Write the power table of the emitters [(shape index, power)], return the total power"""
+    shape_indices = np.array([index for (index, _) in emitters], dtype="<u4")
+    powers = np.array([power for (_, power) in emitters], dtype="<f4")
+    (cdf, total) = normalized_cdf(powers.astype(np.float64))
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    tmp = mesh_export.temporary_path(file)
+    with open(tmp, 'wb') as out:
+        out.write(SAMPLING_HEADER.pack(EMITTERS_MAGIC, SAMPLING_VERSION, len(emitters), total))
+        out.write(shape_indices.tobytes())
+        out.write(powers.tobytes())
+        out.write(cdf.tobytes())
+    os.replace(tmp, file)
+    return float(total)
+
+def read_table(file, magic):
+    with open(file, 'rb') as f:
+        data = f.read()
+    (file_magic, version, count, total) = SAMPLING_HEADER.unpack_from(data)
+    if file_magic != magic or version != SAMPLING_VERSION:
+        raise ValueError(f"Not a sampling table (version {SAMPLING_VERSION}): {file}")
+    return (data[SAMPLING_HEADER.size:], count, total)
+
+def read_triangle_cdf(file):
+    """Return (cdf, total area) of a triangle CDF file"""
+    (data, count, total) = read_table(file, CDF_MAGIC)
+    return (np.frombuffer(data, dtype="<f4", count=count), total)
+
+def read_emitter_table(file):
+    """Return (shape indices, powers, cdf, total power) of an emitter table file"""
+    (data, count, total) = read_table(file, EMITTERS_MAGIC)
+    arrays = [np.frombuffer(data, dtype=dtype, count=count, offset=4 * count * k) for (k, dtype) in enumerate(("<u4", "<f4", "<f4"))]
+    return (*arrays, total)
+
+def envmap_weights(pixels, width, height, gamma=False):
+    """Mean luminance x sin(theta) of a (rows, columns, channels) latitude-longitude image
+    (top to bottom) over a height x width grid (at most the image size)"""
+    rows = np.linspace(0, pixels.shape[0], height + 1).astype(np.int64)
+    columns = np.linspace(0, pixels.shape[1], width + 1).astype(np.int64)
+    weights = np.empty((height, width), dtype=np.float64)
+    # One band of rows at a time: the full image is never converted at once
+    for y in range(height):
+        band = pixels[rows[y]:rows[y + 1]]
+        if band.shape[2] >= 3:
+            band = band[..., :3]
+            if gamma:
+                band = texture_bake.srgb_to_linear(band)
+            lum = band @ np.array([0.2126, 0.7152, 0.0722], dtype=band.dtype)
+        else:
+            lum = texture_bake.srgb_to_linear(band[..., 0]) if gamma else band[..., 0]
+        weights[y] = np.add.reduceat(lum.sum(axis=0, dtype=np.float64), columns[:-1]) / (len(band) * np.diff(columns))
+    theta = (np.arange(height) + 0.5) / height * math.pi
+    return np.maximum(weights, 0.0) * np.sin(theta)[:, None]
+
+def write_envmap_distribution(file, weights):
+    """Write the marginal and conditional CDFs of a (height, width) weight grid"""
+    (height, width) = weights.shape
+    rows = np.cumsum(weights, axis=1)
+    row_totals = rows[:, -1].copy()
+    uniform = np.arange(1, width + 1, dtype=np.float64) / width
+    conditional = np.where(row_totals[:, None] > 0, rows / np.where(row_totals > 0, row_totals, 1.0)[:, None], uniform)
+    (marginal, total) = normalized_cdf(row_totals)
+    # Integral over the sphere parametrization: (2 pi / width) x (pi / height) per cell
+    integral = total * 2 * math.pi * math.pi / (width * height)
+    tmp = mesh_export.temporary_path(file)
+    with open(tmp, 'wb') as out:
+        out.write(ENVMAP_HEADER.pack(ENVMAP_MAGIC, SAMPLING_VERSION, width, height, integral))
+        out.write(marginal.tobytes())
+        out.write(conditional.astype("<f4").tobytes())
+    os.replace(tmp, file)
+
+def read_envmap_distribution(file):
+    """Return (marginal cdf, conditional cdfs (height x width), integral) of an envmap distribution file"""
+    with open(file, 'rb') as f:
+        data = f.read()
+    (magic, version, width, height, integral) = ENVMAP_HEADER.unpack_from(data)
+    if magic != ENVMAP_MAGIC or version != SAMPLING_VERSION:
+        raise ValueError(f"Not an envmap distribution (version {SAMPLING_VERSION}): {file}")
+    marginal = np.frombuffer(data, dtype="<f4", count=height, offset=ENVMAP_HEADER.size)
+    conditional = np.frombuffer(data, dtype="<f4", count=width * height, offset=ENVMAP_HEADER.size + 4 * height)
+    return (marginal, conditional.reshape(height, width), integral)
@@ -0,0 +1,156 @@
+import os
+import struct
+import numpy as np
+
+from . import mesh_export
+
+# BVH sidecar layout (little-endian):
+#   header: magic, version, node count, triangle count, maximum leaf size
+#   nodes (64-byte aligned, 32 bytes each): bounding box min (3 x f32), max (3 x f32), offset, count
+#     inner node: count == 0, offset is the index of the left child (the right child follows it)
+#     leaf: offset is the first triangle, count the number of triangles
+#   The triangles of the mesh file are ordered so that each leaf covers a contiguous range.
+BVH_MAGIC = b"MTIBVH\0\0"
+BVH_VERSION = 1
+BVH_HEADER = struct.Struct("<8sIIII")
+BVH_NODE = np.dtype([("min", "<f4", 3), ("max", "<f4", 3), ("offset", "<u4"), ("count", "<u4")])
+BVH_EXTENSION = ".bvh"
+
+# Binned SAH build settings
+SAH_BINS = 16
+LEAF_SIZE = 4
+MAX_LEAF_SIZE = 16
+TRAVERSAL_COST = 1.0
+
+def bvh_filename(filename):
+    """Name of the BVH sidecar of a mesh file"""
+    return os.path.splitext(filename)[0] + BVH_EXTENSION
+
+def surface_area(lower, upper):
+    d = np.maximum(upper - lower, 0)
+    return 2 * (d[..., 0] * d[..., 1] + d[..., 1] * d[..., 2] + d[..., 2] * d[..., 0])
+
+def build_bvh(positions, indices, leaf_size=LEAF_SIZE):
+    """Build a binned SAH BVH over the triangles, return (nodes, triangle order)
+
+    The nodes of a level are split together, each step works on all the triangles of the level at once.
+    """
+    triangles = positions[indices]
+    tmin = triangles.min(axis=1)
+    tmax = triangles.max(axis=1)
+    centroids = (tmin + tmax) * 0.5
+    nb_tris = len(indices)
+
+    nodes = np.zeros(max(2 * nb_tris - 1, 1), dtype=BVH_NODE)
+    order = np.arange(nb_tris)
+    # Active nodes: id, first triangle (in order) and triangle count
+    ids = np.zeros(1, dtype=np.int64)
+    starts = np.zeros(1, dtype=np.int64)
+    counts = np.full(1, nb_tris, dtype=np.int64)
+    nb_nodes = 1
+
+    while len(ids) != 0:
+        k = len(ids)
+        # Triangles of the active nodes, grouped by node
+        segment = np.repeat(np.arange(k), counts)
+        offsets = np.cumsum(counts) - counts
+        positions_in_order = starts[segment] + np.arange(len(segment)) - offsets[segment]
+        selected = order[positions_in_order]
+
+        node_min = np.minimum.reduceat(tmin[selected], offsets)
+        node_max = np.maximum.reduceat(tmax[selected], offsets)
+        nodes["min"][ids] = node_min
+        nodes["max"][ids] = node_max
+
+        # Bin the centroids along each axis
+        cmin = np.minimum.reduceat(centroids[selected], offsets)
+        cmax = np.maximum.reduceat(centroids[selected], offsets)
+        extent = cmax - cmin
+        scale = np.divide(SAH_BINS * (1 - 1e-6), extent, out=np.zeros_like(extent), where=extent > 0)
+        bins = ((centroids[selected] - cmin[segment]) * scale[segment]).astype(np.int64)
+        np.clip(bins, 0, SAH_BINS - 1, out=bins)
+
+        costs = np.full((k, 3, SAH_BINS - 1), np.inf)
+        for axis in range(3):
+            key = segment * SAH_BINS + bins[:, axis]
+            bin_count = np.bincount(key, minlength=k * SAH_BINS).reshape(k, SAH_BINS)
+            bin_min = np.full((k * SAH_BINS, 3), np.inf)
+            bin_max = np.full((k * SAH_BINS, 3), -np.inf)
+            by_bin = np.argsort(key, kind='stable')
+            used = np.flatnonzero(bin_count.ravel())
+            bin_starts = np.cumsum(bin_count.ravel())[used] - bin_count.ravel()[used]
+            bin_min[used] = np.minimum.reduceat(tmin[selected[by_bin]], bin_starts)
+            bin_max[used] = np.maximum.reduceat(tmax[selected[by_bin]], bin_starts)
+            bin_min = bin_min.reshape(k, SAH_BINS, 3)
+            bin_max = bin_max.reshape(k, SAH_BINS, 3)
+
+            # Sweep from both sides: split s puts the bins [0, s] on the left
+            left_count = np.cumsum(bin_count, axis=1)[:, :-1]
+            right_count = counts[:, None] - left_count
+            left_area = surface_area(np.minimum.accumulate(bin_min, axis=1), np.maximum.accumulate(bin_max, axis=1))[:, :-1]
+            right_area = surface_area(np.minimum.accumulate(bin_min[:, ::-1], axis=1)[:, ::-1],
+                                      np.maximum.accumulate(bin_max[:, ::-1], axis=1)[:, ::-1])[:, 1:]
+            with np.errstate(invalid='ignore'):
+                cost = left_area * left_count + right_area * right_count
+            valid = (left_count != 0) & (right_count != 0)
+            costs[:, axis] = np.where(valid, cost, np.inf)
+
+        best = costs.reshape(k, -1).argmin(axis=1)
+        best_axis = best // (SAH_BINS - 1)
+        best_split = best % (SAH_BINS - 1)
+        best_cost = costs.reshape(k, -1)[np.arange(k), best]
+        area = surface_area(node_min, node_max)
+        split_cost = TRAVERSAL_COST + np.divide(best_cost, area, out=np.zeros_like(area), where=area > 0)
+
+        # Small nodes become leaves when splitting does not pay off, nodes without any split are cut in half
+        leaf = (counts <= leaf_size) | ((counts <= MAX_LEAF_SIZE) & (split_cost >= counts))
+        median = ~leaf & ~np.isfinite(best_cost)
+        split = ~leaf
+
+        nodes["offset"][ids[leaf]] = starts[leaf]
+        nodes["count"][ids[leaf]] = counts[leaf]
+        if not split.any():
+            break
+
+        # Stable partition of the triangles of the split nodes
+        goes_left = bins[np.arange(len(segment)), best_axis[segment]] <= best_split[segment]
+        rank = np.arange(len(segment)) - offsets[segment]
+        goes_left = np.where(median[segment], rank < counts[segment] // 2, goes_left)
+        moving = split[segment]
+        key = segment[moving] * 2 + (~goes_left[moving])
+        permutation = np.argsort(key, kind='stable')
+        order[positions_in_order[moving]] = selected[moving][permutation]
+        left_counts = np.bincount(segment[moving], weights=goes_left[moving], minlength=k).astype(np.int64)[split]
+
+        # Children are allocated next to each other
+        nb_split = int(split.sum())
+        left_ids = nb_nodes + 2 * np.arange(nb_split)
+        nodes["offset"][ids[split]] = left_ids
+        nodes["count"][ids[split]] = 0
+        nb_nodes += 2 * nb_split
+
+        split_starts = starts[split]
+        split_counts = counts[split]
+        ids = np.concatenate([left_ids, left_ids + 1])
+        starts = np.concatenate([split_starts, split_starts + left_counts])
+        counts = np.concatenate([left_counts, split_counts - left_counts])
+
+    return (nodes[:nb_nodes], order)
+
+def write_bvh(file, nodes, nb_tris, leaf_size=LEAF_SIZE):
+    """Write a BVH sidecar file (the file appears only once complete)"""
+    tmp = mesh_export.temporary_path(file)
+    with open(tmp, 'wb') as out:
+        out.write(BVH_HEADER.pack(BVH_MAGIC, BVH_VERSION, len(nodes), nb_tris, max(leaf_size, MAX_LEAF_SIZE)))
+        out.write(b"\0" * (mesh_export.align(BVH_HEADER.size) - BVH_HEADER.size))
+        out.write(nodes.tobytes())
+    os.replace(tmp, file)
+
+def read_bvh(file):
+    """Memory-map the nodes of a BVH sidecar file, return (nodes, triangle count)"""
+    with open(file, 'rb') as f:
+        (magic, version, nb_nodes, nb_tris, _) = BVH_HEADER.unpack(f.read(BVH_HEADER.size))
+    if magic != BVH_MAGIC or version != BVH_VERSION:
+        raise ValueError(f"Not a BVH file (version {BVH_VERSION}): {file}")
+    nodes = np.memmap(file, dtype=BVH_NODE, mode='r', offset=mesh_export.align(BVH_HEADER.size), shape=(nb_nodes,))
+    return (nodes, nb_tris)
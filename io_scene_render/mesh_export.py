@@ -0,0 +1,379 @@
+import os
+import hashlib
+import threading
+import zlib
+import struct
+import numpy as np
+
+# Binary mesh layout (little-endian):
+#   header: magic, version, flags, vertex count, triangle count,
+#           then the byte offsets of the position, normal, uv and index arrays
+#   arrays: float32 xyz positions, float32 xyz normals, float32 uv, uint32 triangle indices
+# Each array starts on a BINARY_ALIGNMENT boundary so it can be mmap-ed directly.
+BINARY_MAGIC = b"MTIMESH\0"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("<8sIIII4Q")
+BINARY_ALIGNMENT = 64
+FLAG_NORMALS = 1
+FLAG_UVS = 2
+
+# Compressed mesh layout (little-endian):
+#   header: magic, version, flags, vertex count, triangle count, position bits,
+#           position bounding box (min, max), uv bounding box (min, max),
+#           maximum position / normal (radians) / uv errors, then the byte size of each stream
+#   streams (zlib): positions quantized to the bounding box (uint16, or uint32 above 16 bits),
+#           octahedron encoded normals (2 x int16), uvs quantized to their bounding box (uint16),
+#           zigzag delta encoded triangle indices (uint32)
+COMPRESSED_MAGIC = b"MTICMSH\0"
+COMPRESSED_VERSION = 1
+COMPRESSED_HEADER = struct.Struct("<8sIIIII3f3f2f2f3f4Q")
+# Positions are decoded to float32 (24-bit significand): beyond 22 bits the quantization step gets
+# within a few float32 ulps of the coordinates and the decoded positions are not more accurate
+MAX_POSITION_BITS = 22
+
+# File extension for each mesh output format
+MESH_EXTENSIONS = {
+    "obj" : ".obj",
+    "binary" : ".mesh",
+    "compressed" : ".cmesh"
+}
+
+# Number of rows formatted per write call (bounds the temporary string size)
+CHUNK_ROWS = 1 << 16
+
+def extract_mesh(mesh):
+    """Return the evaluated mesh data as flat arrays (no per-element python access)"""
+    nb_vertices = len(mesh.vertices)
+    nb_loops = len(mesh.loops)
+    nb_tris = len(mesh.loop_triangles)
+
+    positions = np.empty(nb_vertices * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", positions)
+
+    tri_loops = np.empty(nb_tris * 3, dtype=np.int32)
+    mesh.loop_triangles.foreach_get("loops", tri_loops)
+
+    tri_materials = np.empty(nb_tris, dtype=np.int32)
+    mesh.loop_triangles.foreach_get("material_index", tri_materials)
+
+    loop_vertices = np.empty(nb_loops, dtype=np.int32)
+    mesh.loops.foreach_get("vertex_index", loop_vertices)
+
+    normals = np.empty(nb_loops * 3, dtype=np.float32)
+    mesh.loops.foreach_get("normal", normals)
+
+    # Only the active UV layer is exported
+    uvs = None
+    uv_layer = mesh.uv_layers.active
+    if uv_layer is not None:
+        uvs = np.empty(nb_loops * 2, dtype=np.float32)
+        uv_layer.data.foreach_get("uv", uvs)
+        uvs = uvs.reshape(-1, 2)
+
+    # Partition the triangles by material once (stable to keep the triangle order)
+    material_order = np.argsort(tri_materials, kind="stable")
+    material_offsets = np.zeros(1, dtype=np.int64)
+    if nb_tris != 0:
+        material_offsets = np.concatenate(([0], np.cumsum(np.bincount(tri_materials))))
+
+    return {
+        "positions" : positions.reshape(-1, 3),
+        "loop_vertices" : loop_vertices,
+        "normals" : normals.reshape(-1, 3),
+        "uvs" : uvs,
+        "tri_loops" : tri_loops.reshape(-1, 3),
+        "tri_materials" : tri_materials,
+        "material_order" : material_order,
+        "material_offsets" : material_offsets
+    }
+
+def material_triangles(mesh_data, material_index):
+    """Return the indices of the triangles using material_index"""
+    offsets = mesh_data["material_offsets"]
+    if material_index + 1 >= len(offsets):
+        return mesh_data["material_order"][:0]
+    return mesh_data["material_order"][offsets[material_index]:offsets[material_index + 1]]
+
+def weld_loops(mesh_data, loops):
+    """Deduplicate the corners sharing the same (vertex, split normal, uv)
+    Return the unique loops (in first use order) and the index of each corner into them"""
+    keys = [mesh_data["loop_vertices"][loops].reshape(-1, 1).view(np.uint32),
+            mesh_data["normals"][loops].view(np.uint32)]
+    if mesh_data["uvs"] is not None:
+        keys.append(mesh_data["uvs"][loops].view(np.uint32))
+    keys = np.ascontiguousarray(np.hstack(keys))
+    keys = keys.view(np.dtype((np.void, keys.dtype.itemsize * keys.shape[1]))).ravel()
+
+    (_, first, inverse) = np.unique(keys, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    remap = np.empty(len(order), dtype=np.uint32)
+    remap[order] = np.arange(len(order), dtype=np.uint32)
+    return (loops[first[order]], remap[inverse.ravel()])
+
+def gather_shape(mesh_data, material_index):
+    """Return the welded vertex buffers (positions, normals, uvs) and the triangle indices
+    of the triangles using material_index"""
+    tri_loops = mesh_data["tri_loops"][material_triangles(mesh_data, material_index)]
+    (loops, indices) = weld_loops(mesh_data, tri_loops.ravel())
+
+    positions = mesh_data["positions"][mesh_data["loop_vertices"][loops]]
+    normals = mesh_data["normals"][loops]
+    uvs = None
+    if mesh_data["uvs"] is not None:
+        uvs = mesh_data["uvs"][loops]
+    return (positions, normals, uvs, indices.reshape(-1, 3))
+
+def decimate_shape(positions, normals, uvs, indices, cell):
+    """Vertex clustering: merge the vertices falling in the same cell of a grid (cell size in object units)
+    and drop the collapsed triangles"""
+    cells = np.floor((positions - positions.min(axis=0)) / cell).astype(np.int64)
+    cells = np.ascontiguousarray(cells).view(np.dtype((np.void, cells.dtype.itemsize * 3))).ravel()
+    (_, first, cluster) = np.unique(cells, return_index=True, return_inverse=True)
+    cluster = cluster.ravel()
+
+    # Keep the triangles with three different clusters, then the clusters they use
+    triangles = cluster[indices]
+    keep = ((triangles[:, 0] != triangles[:, 1]) & (triangles[:, 1] != triangles[:, 2]) & (triangles[:, 2] != triangles[:, 0]))
+    triangles = triangles[keep]
+    (used, remapped) = np.unique(triangles, return_inverse=True)
+    weights = np.bincount(cluster, minlength=len(first))[used][:, None]
+
+    def average(values):
+        return np.stack([np.bincount(cluster, weights=values[:, a], minlength=len(first))[used] for a in range(values.shape[1])], axis=1) / weights
+
+    merged_positions = average(positions).astype(np.float32)
+    merged_normals = average(normals)
+    merged_normals /= np.maximum(np.linalg.norm(merged_normals, axis=1, keepdims=True), 1e-12)
+    # UVs are not averaged across seams: each cluster keeps the uv of its first vertex
+    merged_uvs = uvs[first[used]] if uvs is not None else None
+    return (merged_positions, merged_normals.astype(np.float32), merged_uvs, remapped.reshape(-1, 3).astype(np.uint32))
+
+def format_key(mesh_format, position_bits=16):
+    """Name of the output format including its settings (quantization) for content hashing"""
+    if mesh_format == "compressed":
+        return f"compressed{min(position_bits, MAX_POSITION_BITS)}"
+    return mesh_format
+
+def shape_hash(mesh_format, positions, normals, uvs, indices):
+    """Return a digest of the shape content (and the format it is written in)"""
+    digest = hashlib.blake2b(mesh_format.encode(), digest_size=16)
+    for array in (positions, normals, uvs, indices):
+        if array is None:
+            digest.update(b"none")
+        else:
+            digest.update(str(array.shape).encode())
+            digest.update(np.ascontiguousarray(array).data)
+    return digest.hexdigest()
+
+def mesh_fingerprint(mesh_data, *settings):
+    """Return a digest of the extracted mesh arrays (and of the settings, compared by repr)"""
+    digest = hashlib.blake2b(repr(settings).encode(), digest_size=16)
+    for key in ("positions", "loop_vertices", "normals", "uvs", "tri_loops", "tri_materials"):
+        array = mesh_data[key]
+        digest.update(b"none" if array is None else np.ascontiguousarray(array).data)
+    return digest.hexdigest()
+
+def write_rows(out, fmt, rows):
+    """Write a 2D array with one formatted line per row"""
+    for start in range(0, len(rows), CHUNK_ROWS):
+        block = rows[start:start + CHUNK_ROWS]
+        out.write((fmt * len(block)) % tuple(block.ravel().tolist()))
+
+def write_obj(file, positions, normals, uvs, indices):
+    """Write an OBJ file where positions, normals and uvs share the same (0-based) triangle indices"""
+    with open(file, 'w') as out:
+        write_rows(out, 'v %.6f %.6f %.6f\n', positions)
+        write_rows(out, 'vn %.6f %.6f %.6f\n', normals)
+        if uvs is not None:
+            write_rows(out, 'vt %.6f %.6f\n', uvs)
+
+        # write f: ver ind/ uv ind
+        faces = indices.astype(np.int64) + 1
+        if uvs is not None:
+            write_rows(out, 'f %d/%d/%d %d/%d/%d %d/%d/%d\n', np.repeat(faces, 3, axis=1))
+        else:
+            write_rows(out, 'f %d//%d %d//%d %d//%d\n', np.repeat(faces, 2, axis=1))
+
+def align(offset):
+    return (offset + BINARY_ALIGNMENT - 1) // BINARY_ALIGNMENT * BINARY_ALIGNMENT
+
+def write_binary_mesh(file, positions, normals, uvs, indices):
+    """Write a binary mesh file where positions, normals and uvs share the same (0-based) triangle indices"""
+    arrays = [
+        np.ascontiguousarray(positions, dtype="<f4"),
+        np.ascontiguousarray(normals, dtype="<f4"),
+        np.ascontiguousarray(uvs, dtype="<f4") if uvs is not None else None,
+        np.ascontiguousarray(indices, dtype="<u4")
+    ]
+    flags = FLAG_NORMALS
+    if uvs is not None:
+        flags |= FLAG_UVS
+
+    # Compute the array offsets (0 when the array is missing)
+    offsets = []
+    offset = align(BINARY_HEADER.size)
+    for array in arrays:
+        if array is None:
+            offsets.append(0)
+        else:
+            offsets.append(offset)
+            offset = align(offset + array.nbytes)
+
+    with open(file, 'wb') as out:
+        out.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, flags,
+            len(positions), len(indices), *offsets))
+        for (array, offset) in zip(arrays, offsets):
+            if array is None:
+                continue
+            out.write(b"\0" * (offset - out.tell()))
+            out.write(array.tobytes())
+
+def read_binary_mesh(file):
+    """Map a binary mesh file, return (positions, normals, uvs, indices) views"""
+    with open(file, 'rb') as f:
+        (magic, version, flags, nb_vertices, nb_tris, *offsets) = BINARY_HEADER.unpack(f.read(BINARY_HEADER.size))
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        raise ValueError(f"Not a binary mesh file (version {BINARY_VERSION}): {file}")
+    data = np.memmap(file, dtype=np.uint8, mode='r')
+    def view(offset, dtype, shape):
+        if offset == 0:
+            return None
+        count = shape[0] * shape[1]
+        return np.frombuffer(data, dtype=dtype, count=count, offset=offset).reshape(shape)
+    return (
+        view(offsets[0], "<f4", (nb_vertices, 3)),
+        view(offsets[1], "<f4", (nb_vertices, 3)),
+        view(offsets[2], "<f4", (nb_vertices, 2)),
+        view(offsets[3], "<u4", (nb_tris, 3))
+    )
+
+def quantize(values, bits):
+    """Quantize values to their bounding box, return (quantized, min, max, maximum error)"""
+    lower = values.min(axis=0) if len(values) else np.zeros(values.shape[1], dtype=np.float32)
+    upper = values.max(axis=0) if len(values) else np.zeros(values.shape[1], dtype=np.float32)
+    levels = (1 << bits) - 1
+    extent = upper.astype(np.float64) - lower.astype(np.float64)
+    scale = np.divide(levels, extent, out=np.zeros_like(extent), where=extent > 0)
+    quantized = np.round((values.astype(np.float64) - lower) * scale).astype(np.uint32 if bits > 16 else np.uint16)
+    # Measured on the decoded float32 values: half a step per axis plus the float32 rounding
+    error = 0.0
+    if len(values):
+        error = float(np.abs(dequantize(quantized, lower, upper, bits).astype(np.float64) - values).max())
+    return (quantized, lower, upper, float32_upper_bound(error))
+
+def float32_upper_bound(value):
+    """Smallest float32 not below value (errors are stored as float32 and must stay bounds)"""
+    rounded = np.float32(value)
+    if rounded < value:
+        rounded = np.nextafter(rounded, np.float32(np.inf))
+    return float(rounded)
+
+def dequantize(quantized, lower, upper, bits):
+    levels = (1 << bits) - 1
+    # In float64 from the float32 bounds of the header, so the writer measures what the reader decodes
+    lower = np.asarray(lower, dtype=np.float32).astype(np.float64)
+    upper = np.asarray(upper, dtype=np.float32).astype(np.float64)
+    return (lower + quantized.astype(np.float64) * ((upper - lower) / levels)).astype(np.float32)
+
+def octahedral_encode(normals):
+    """Encode unit vectors as two signed 16-bit values (octahedral mapping)"""
+    normals = normals.astype(np.float64)
+    length = np.abs(normals).sum(axis=1, keepdims=True)
+    normals = np.where(length > 0, normals / np.where(length > 0, length, 1), [0.0, 0.0, 1.0])
+    (x, y, z) = normals.T
+    sign = lambda v: np.where(v >= 0, 1.0, -1.0)
+    u = np.where(z < 0, (1 - np.abs(y)) * sign(x), x)
+    v = np.where(z < 0, (1 - np.abs(x)) * sign(y), y)
+    return np.round(np.clip(np.stack([u, v], axis=1), -1, 1) * 32767).astype(np.int16)
+
+def octahedral_decode(encoded):
+    (u, v) = (encoded.astype(np.float64) / 32767).T
+    z = 1 - np.abs(u) - np.abs(v)
+    t = np.maximum(-z, 0)
+    x = u + np.where(u >= 0, -t, t)
+    y = v + np.where(v >= 0, -t, t)
+    normals = np.stack([x, y, z], axis=1)
+    return (normals / np.linalg.norm(normals, axis=1, keepdims=True)).astype(np.float32)
+
+def angular_error(a, b):
+    """Largest angle (radians) between the directions of a and b"""
+    if len(a) == 0:
+        return 0.0
+    a = a / np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-30)
+    b = b / np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-30)
+    return float(np.arccos(np.clip((a * b).sum(axis=1), -1.0, 1.0)).max())
+
+def delta_encode(indices):
+    """Zigzag encoded differences between consecutive indices"""
+    deltas = np.diff(indices.ravel().astype(np.int64), prepend=0)
+    return ((deltas << 1) ^ (deltas >> 63)).astype("<u4")
+
+def delta_decode(encoded):
+    encoded = encoded.astype(np.int64)
+    return np.cumsum((encoded >> 1) ^ -(encoded & 1)).astype(np.uint32)
+
+def write_compressed_mesh(file, positions, normals, uvs, indices, position_bits=16):
+    """Write a quantized and compressed mesh file, return the maximum (position, normal, uv) errors
+    (position_bits is capped to MAX_POSITION_BITS)"""
+    position_bits = min(position_bits, MAX_POSITION_BITS)
+    (qpositions, pmin, pmax, position_error) = quantize(positions, position_bits)
+    encoded_normals = octahedral_encode(normals)
+    normal_error = float32_upper_bound(angular_error(normals.astype(np.float64), octahedral_decode(encoded_normals)))
+    streams = [qpositions.astype("<u4" if position_bits > 16 else "<u2"), encoded_normals.astype("<i2")]
+    (uvmin, uvmax, uv_error) = (np.zeros(2), np.zeros(2), 0.0)
+    flags = FLAG_NORMALS
+    if uvs is not None:
+        (quvs, uvmin, uvmax, uv_error) = quantize(uvs, 16)
+        streams.append(quvs.astype("<u2"))
+        flags |= FLAG_UVS
+    else:
+        streams.append(None)
+    streams.append(delta_encode(indices))
+    streams = [zlib.compress(stream.tobytes(), 6) if stream is not None else b"" for stream in streams]
+
+    with open(file, 'wb') as out:
+        out.write(COMPRESSED_HEADER.pack(COMPRESSED_MAGIC, COMPRESSED_VERSION, flags,
+            len(positions), len(indices), position_bits, *pmin, *pmax, *uvmin, *uvmax,
+            position_error, normal_error, uv_error, *[len(stream) for stream in streams]))
+        for stream in streams:
+            out.write(stream)
+    return (position_error, normal_error, uv_error)
+
+def read_compressed_mesh(file):
+    """Decode a compressed mesh file, return (positions, normals, uvs, indices, (position, normal, uv) errors)"""
+    with open(file, 'rb') as f:
+        data = f.read()
+    header = COMPRESSED_HEADER.unpack_from(data)
+    (magic, version, flags, nb_vertices, nb_tris, position_bits) = header[:6]
+    if magic != COMPRESSED_MAGIC or version != COMPRESSED_VERSION:
+        raise ValueError(f"Not a compressed mesh file (version {COMPRESSED_VERSION}): {file}")
+    (pmin, pmax, uvmin, uvmax) = (np.array(header[6:9]), np.array(header[9:12]), np.array(header[12:14]), np.array(header[14:16]))
+    errors = header[16:19]
+    streams = []
+    offset = COMPRESSED_HEADER.size
+    for size in header[19:23]:
+        streams.append(zlib.decompress(data[offset:offset + size]) if size else None)
+        offset += size
+
+    positions = dequantize(np.frombuffer(streams[0], dtype="<u4" if position_bits > 16 else "<u2").reshape(-1, 3), pmin, pmax, position_bits)
+    normals = octahedral_decode(np.frombuffer(streams[1], dtype="<i2").reshape(-1, 2))
+    uvs = None
+    if flags & FLAG_UVS:
+        uvs = dequantize(np.frombuffer(streams[2], dtype="<u2").reshape(-1, 2), uvmin, uvmax, 16)
+    indices = delta_decode(np.frombuffer(streams[3], dtype="<u4")).reshape(-1, 3)
+    return (positions, normals, uvs, indices, errors)
+
+def temporary_path(file):
+    """Unique temporary name next to file (several threads or processes can export the same shape)"""
+    return f"{file}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+def write_mesh(file, mesh_format, positions, normals, uvs, indices, position_bits=16):
+    """Write the mesh in the requested output format (the file appears only once complete)"""
+    tmp = temporary_path(file)
+    if mesh_format == "binary":
+        write_binary_mesh(tmp, positions, normals, uvs, indices)
+    elif mesh_format == "compressed":
+        write_compressed_mesh(tmp, positions, normals, uvs, indices, position_bits)
+    else:
+        write_obj(tmp, positions, normals, uvs, indices)
+    os.replace(tmp, file)
@@ -5,8 +5,20 @@ import math
 from math import *
 import mathutils
 from mathutils import Vector
-import shutil
 import json
+import hashlib
+import time
+import numpy as np
+from . import mesh_export
+from . import mesh_bvh
+from . import light_sampling
+from . import camera_culling
+from . import export_manifest
+from . import export_pool
+from . import export_metrics
+from . import texture_store
+from . import texture_budget
+from . import scene_writer
 
 #render engine custom begin
 class RendererRenderEngine(bpy.types.RenderEngine):
@@ -41,7 +53,11 @@ for member in dir(properties_material):
         pass
 
 bpy.utils.register_class(RendererRenderEngine)
-exportedMaterials = list()
+exportedMaterials = set()
+# Exported materials kept for the whole batch ((material name, output path) -> (fingerprint, json))
+materialCache = {}
+# Textures reduced by the texture budget for the whole batch (source path -> (width, height))
+textureSizes = {}
 
 #Camera code:
 #https://blender.stackexchange.com/questions/16472/how-can-i-get-the-cameras-projection-matrix
@@ -54,7 +70,7 @@ def measure(first, second):
     return distance
 
 def export_camera(parent, scene):
-    parent.report({'INFO'}, " Fetching camera..")
+    export_metrics.log(parent, " Fetching camera..")
     cam_ob = bpy.context.scene.camera
     if cam_ob is None:
         parent.error({"ERROR"}, "no scene camera,aborting")
@@ -104,26 +120,97 @@ def export_camera(parent, scene):
 def texture_might_exist(inputSlot):
     return len(inputSlot.links) > 0
 
-def texture_copy(parent, node, filepath):
+def texture_copy(parent, node, filepath, gamma=True):
+    """Add the image of the node to the texture store, return its path relative to the scene file
+    (the pre-baked mipmapped version if enabled)"""
     fromFile = bpy.path.abspath(node.image.filepath)
-    head, tail = os.path.split(fromFile)
-    
-    toFile = bpy.path.abspath(filepath + '/textures/' + tail)
-    parent.report({'INFO'}, f"Copying texture: {fromFile} to {toFile}")
-    if not os.path.exists(os.path.dirname(toFile)):
-        os.makedirs(os.path.dirname(toFile))
     
     if not os.path.exists(fromFile):
         parent.report({'ERROR'}, f"Texture does not exist: {fromFile}. You might forget to unpack the file.")
         parent.error_or_warning = True
         parent.fatal_error = True
-        return
+        return "textures/" + os.path.split(fromFile)[1]
     
-    if os.path.realpath(fromFile) != os.path.realpath(toFile):
-        if os.path.exists(toFile):
-             parent.report({'WARNING'}, f"Texture already exist: {toFile}. Do not copy")
-        else:
-            shutil.copyfile(os.path.realpath(fromFile), os.path.realpath(toFile))
+    # Resolution chosen by the texture budget (envmaps are kept at full resolution)
+    size = textureSizes.get(os.path.realpath(fromFile)) if node.bl_idname == "ShaderNodeTexImage" else None
+    with export_metrics.phase("textures"):
+        store = texture_store.open_store(bpy.path.abspath(filepath + '/textures/'))
+        if bpy.context.scene.bake_textures:
+            return "textures/" + store.bake(parent, node.image, fromFile, gamma, size)
+        if size is not None:
+            return "textures/" + store.resize(parent, fromFile, size, lambda path, width, height: save_resized(node.image, path, width, height))
+        return "textures/" + store.add(parent, fromFile)
+
+def save_resized(image, path, width, height):
+    """Write a copy of the image scaled to width x height (in the file format of the image)"""
+    resized = image.copy()
+    try:
+        resized.scale(width, height)
+        resized.filepath_raw = path
+        resized.file_format = image.file_format
+        resized.save()
+    finally:
+        bpy.data.images.remove(resized)
+
+def plan_textures(parent, scene):
+    """Choose the resolution of the image textures of the scene within the texture budget,
+    return {source path : (width, height)} of the ones to reduce"""
+    if scene.texture_budget == 'none':
+        return {}
+    # Ratio: texels allowed per pixel covered on screen by the objects using the texture (the whole frame without camera)
+    frustum = camera_culling.camera_frustum(scene) if scene.texture_budget == 'ratio' else None
+    frame = max(scene.resolution_x, scene.resolution_y)
+    textures = {}
+    for object in scene.objects:
+        if object.hide_render or object.type != 'MESH':
+            continue
+        coverage = frame if frustum is None else min(frustum.screen_size(camera_culling.object_corners(object)), frame)
+        for slot in object.material_slots:
+            material = slot.material
+            if material is None or material.node_tree is None:
+                continue
+            for node in material.node_tree.nodes:
+                image = getattr(node, "image", None)
+                if node.bl_idname != "ShaderNodeTexImage" or image is None:
+                    continue
+                source = os.path.realpath(bpy.path.abspath(image.filepath))
+                if not os.path.exists(source) or image.size[0] == 0:
+                    continue
+                texture = textures.setdefault(source, {"name" : image.name, "size" : tuple(image.size),
+                    "channels" : image.channels, "is_float" : image.is_float, "coverage" : 0.0})
+                texture["coverage"] = max(texture["coverage"], coverage)
+    if scene.texture_budget == 'ratio':
+        for texture in textures.values():
+            texture["max_size"] = int(math.ceil(scene.texture_max_ratio * texture["coverage"]))
+    budget = scene.texture_budget_mb * 2**20 if scene.texture_budget == 'memory' else None
+    plan = texture_budget.plan_budget(textures, budget)
+
+    sizes = {}
+    (before, after) = (0, 0)
+    for (source, (width, height, reason)) in sorted(plan.items()):
+        texture = textures[source]
+        before += texture_budget.texture_bytes(*texture["size"], texture["channels"], texture["is_float"])
+        after += texture_budget.texture_bytes(width, height, texture["channels"], texture["is_float"])
+        if export_metrics.current is not None:
+            export_metrics.current.add_texture(texture["name"], texture["size"], (width, height), reason)
+        if reason is not None:
+            sizes[source] = (width, height)
+            export_metrics.log(parent, f"Texture budget: {texture['name']} {texture['size'][0]}x{texture['size'][1]} -> {width}x{height} ({reason})")
+    parent.report({'INFO'}, f"Texture budget: {len(sizes)} of {len(plan)} textures reduced, {before / 2**20:.1f} MB -> {after / 2**20:.1f} MB")
+    if budget is not None and after > budget:
+        parent.report({'WARNING'}, f"Texture budget exceeded: {after / 2**20:.1f} MB with every texture at the minimum size")
+        parent.error_or_warning = True
+    return sizes
+
+def envmap_distribution(parent, node, filepath, width):
+    """Add the importance sampling distribution of the envmap of the node to the texture store
+    (grid of width x width / 2 cells), return its path relative to the scene file"""
+    fromFile = bpy.path.abspath(node.image.filepath)
+    if not os.path.exists(fromFile):
+        return None
+    with export_metrics.phase("textures"):
+        store = texture_store.open_store(bpy.path.abspath(filepath + '/textures/'))
+        return "textures/" + store.envmap_distribution(parent, node.image, fromFile, width, max(width // 2, 1))
 
 def only_value (parent, inputSlot):
     """Return value"""
@@ -170,9 +257,9 @@ def texture_or_value (parent, inputSlot, filepath, scale=1.0, is_normal_map = Fa
             return {}
         
 
-    parent.report({'INFO'}, f"Texture type: {node.bl_idname}")
+    export_metrics.log(parent, f"Texture type: {node.bl_idname}")
     if node.bl_idname == "ShaderNodeTexChecker":
-        parent.report({'INFO'}, " Detect checkerboard texture")
+        export_metrics.log(parent, " Detect checkerboard texture")
         # Checker board
         c1 = node.inputs[1].default_value
         c2 = node.inputs[2].default_value
@@ -185,17 +272,15 @@ def texture_or_value (parent, inputSlot, filepath, scale=1.0, is_normal_map = Fa
             "type" : "checkerboard2d"
         }
     elif node.bl_idname == "ShaderNodeTexEnvironment":
-        texture_copy(parent, node, filepath)
         return {
             "type" : "texture",
-            "filename" : "textures/"+node.image.name,
+            "filename" : texture_copy(parent, node, filepath, gamma=False),
         }
     elif node.bl_idname == "ShaderNodeTexImage":
-        filename = os.path.split(node.image.filepath.replace("\\","//"))[1]
-        parent.report({'INFO'}, f"Detect Texture image: {node.image.name} | {filename}") 
-        texture_copy(parent, node, filepath)
+        export_metrics.log(parent, f"Detect Texture image: {node.image.name} | {node.image.filepath}")
+        filename = texture_copy(parent, node, filepath, gamma=not is_normal_map)
         if len(node.inputs[0].links) > 0:
-            parent.report({'INFO'}, f"Number links For Texture mapping: {len(node.inputs[0].links)}")
+            export_metrics.log(parent, f"Number links For Texture mapping: {len(node.inputs[0].links)}")
 
             # TODO: Assume mapping node for texture manipulation
             # TODO: Fix this later
@@ -212,7 +297,7 @@ def texture_or_value (parent, inputSlot, filepath, scale=1.0, is_normal_map = Fa
             # TODO: Might not be standard mapping
             return {
                 "type" : "texture",
-                "filename" : "textures/"+filename,
+                "filename" : filename,
                 # "scale" : scaleXYZ,
                 # "translate" : translate,
                 # "rotation" : rot_angles,
@@ -224,7 +309,7 @@ def texture_or_value (parent, inputSlot, filepath, scale=1.0, is_normal_map = Fa
             # Default export
             return {
                 "type" : "texture",
-                "filename" : "textures/"+filename,
+                "filename" : filename,
                 "gamma" : not is_normal_map,
                 "scale" : scale
             }
@@ -246,7 +331,7 @@ def texture_or_value (parent, inputSlot, filepath, scale=1.0, is_normal_map = Fa
             
 
 def export_material_node(parent, scene, mat, materialName, filepath):
-    parent.report({'INFO'}, "Exporting material node type : " + mat.bl_idname)
+    export_metrics.log(parent, "Exporting material node type : " + mat.bl_idname)
     mat_data = {}
     if mat.bl_idname == 'ShaderNodeBsdfDiffuse':
         mat_data["type"] = "diffuse"
@@ -339,12 +424,48 @@ def export_material_node(parent, scene, mat, materialName, filepath):
         mat_data["albedo"] = [0.8, 0.0, 0.8]
     return mat_data
 
+def socket_value(socket):
+    value = getattr(socket, "default_value", None)
+    if hasattr(value, "__len__") and not isinstance(value, str):
+        return tuple(value)
+    return value
+
+def material_fingerprint(scene, material):
+    """Return a digest of everything the export of the material depends on"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((scene.improved_principled, scene.export_normal_map, scene.bake_textures)).encode())
+    if material.node_tree is None:
+        return digest.hexdigest()
+    for node in material.node_tree.nodes:
+        digest.update(repr((node.name, node.bl_idname, [socket_value(s) for s in node.inputs])).encode())
+        for input in node.inputs:
+            for link in input.links:
+                digest.update(repr((link.from_node.name, node.name, input.identifier)).encode())
+        image = getattr(node, "image", None)
+        if image is not None:
+            # Also depends on the texture file itself
+            source = bpy.path.abspath(image.filepath)
+            stat = os.stat(source) if os.path.exists(source) else None
+            digest.update(repr((image.name, source, stat and (stat.st_size, stat.st_mtime_ns))).encode())
+    return digest.hexdigest()
+
+def export_material_cached(parent, scene, material, filepath):
+    """Export the material, reusing the previous export if its node tree did not change"""
+    key = (material.name, filepath)
+    fingerprint = material_fingerprint(scene, material)
+    if key in materialCache and materialCache[key][0] == fingerprint:
+        export_metrics.log(parent, f'Reusing material: {material.name}', {'DEBUG'})
+        return materialCache[key][1]
+    mats = export_material(parent, scene, material, filepath)
+    materialCache[key] = (fingerprint, mats)
+    return mats
+
 def export_material(parent, scene, material, filepath):
     if material is None:
         parent.report({'WARNING'}, " no material on object")
         parent.error_or_warning = True
     mats = []
-    parent.report({'INFO'}, f'Exporting material named: {material.name}')
+    export_metrics.log(parent, f'Exporting material named: {material.name}')
     currentMaterial = None
     material.use_nodes = True
     if material and material.use_nodes: 
@@ -356,143 +477,475 @@ def export_material(parent, scene, material, filepath):
                         mats += [export_material_node(parent, scene, currentMaterial, material.name, filepath)]
     return mats
 
-def write_obj(file, mesh, indices, normals, i):
-    # Pack U,V
-    uvs = []
-    for uv_layer in mesh.uv_layers:
-        for tri in mesh.loop_triangles:
-            if tri.material_index == i:
-                for loop_index in tri.loops:
-                    uvs.append((
-                        uv_layer.data[loop_index].uv[0],
-                        uv_layer.data[loop_index].uv[1]
-                    ))
-
-    # write obj
-    out = open(file, 'w')
-
-    # write vertices positions
-    for id_vertex in indices:
-        out.write('v {:.6f} {:.6f} {:.6f}\n'.format( 
-            mesh.vertices[id_vertex].co.x, 
-            mesh.vertices[id_vertex].co.y, 
-            mesh.vertices[id_vertex].co.z)
-        )
+def instance_key(object):
+    """Return the key of the geometry shared by linked duplicates (None if the object cannot be instanced)"""
+    mesh = object.data
+    if mesh.users < 2 or len(object.modifiers) != 0 or mesh.shape_keys is not None:
+        return None
+    return mesh.name_full
+
+def object_removed(object):
+    """True if the object was deleted since it was listed (its Python reference is invalid)"""
+    try:
+        object.name
+    except ReferenceError:
+        return True
+    return False
+
+def emitter_radiances(mats):
+    """Radiance of the emission materials among the exported ones (material name -> radiance)"""
+    return {mat["name"] : mat["radiance"] for mat in mats if mat.get("type") == "diffuse_light"}
+
+def emitter_slots(scene, materials, radiances):
+    """Slots whose material is an emitter: their shapes get a triangle CDF (with Emitter sampling)"""
+    if not scene.export_emitters:
+        return set()
+    return {i for (i, material) in enumerate(materials) if material is not None and material.name in radiances}
+
+def shape_entry(object, i, filename, sidecars=None):
+    """Return the scene entry of the shape using the slot i of the object"""
+    # TODO: Manage participating media
+    #exportObject_medium(scene_file, object.material_slots[0].material)
+    shape_data = {}
+    shape_data["type"] = "mesh"
+    shape_data["name"] = object.name
+    shape_data["filename"] = filename
+    if sidecars:
+        shape_data.update(sidecars)
+    if len(object.material_slots) != 0:
+        shape_data["material"] = object.material_slots[i].material.name
+    else:
+        # Use the default material
+        shape_data["material"] = "DEFAULT"
     
-    for n in normals:
-        out.write('vn {:.6f} {:.6f} {:.6f}\n'.format(n[0], n[1], n[2]))
+    matrix =  object.matrix_world # transposed()
+    shape_data["transform"] = {
+        "matrix" : [
+            matrix[0][0],matrix[0][1],matrix[0][2],matrix[0][3],
+            matrix[1][0],matrix[1][1],matrix[1][2],matrix[1][3],
+            matrix[2][0],matrix[2][1],matrix[2][2],matrix[2][3],
+            matrix[3][0],matrix[3][1],matrix[3][2],matrix[3][3]
+        ]
+    }                
+    return shape_data
 
-    if len(uvs) != 0:
-        for id in range(len(indices)):
-            out.write('vt {:.6f} {:.6f}\n'.format(uvs[id][0],  uvs[id][1]))
+def shares_geometry(scene):
+    """Content named meshes (meshes/shared): always with animation tracks, where a per-frame file name
+    would be a new filename key for every shape at every frame"""
+    return scene.share_geometry or scene.export_animation
 
-    # write f: ver ind/ uv ind
-    for i in range(0, len(indices), 3):
-        if len(uvs) != 0:
-            out.write(f'f {i+1}/{i+1}/{i+1} {i+2}/{i+2}/{i+2} {i+3}/{i+3}/{i+3}\n')
-        else:
-           out.write(f'f {i+1}//{i+1} {i+2}//{i+2} {i+3}//{i+3}\n')
+def mesh_settings(scene, lod=None, emitters=()):
+    """Export settings the mesh files depend on (part of the fingerprints of objects and instanced meshes)"""
+    return (mesh_export.format_key(scene.mesh_format, scene.position_bits), scene.export_bvh, shares_geometry(scene), lod, sorted(emitters))
+
+def object_fingerprint(scene, object, mesh_data, lod=None, emitters=()):
+    """Digest of everything the shapes of the object are made of: evaluated mesh, modifiers,
+    material assignment and the mesh export settings"""
+    settings = mesh_settings(scene, lod, emitters)
+    modifiers = [(modifier.type, modifier.name, modifier.show_render) for modifier in object.modifiers]
+    materials = [slot.material.name if slot.material is not None else None for slot in object.material_slots]
+    return mesh_export.mesh_fingerprint(mesh_data, settings, modifiers, materials)
+
+def collect_instances(dg):
+    """Group the instances generated by the depsgraph (particles, geometry nodes, collection instances)
+    by source mesh, return [{"name", "materials", "mesh_data", "matrices" (16 values per instance)}]
+
+    The instances are only valid during the iteration: the meshes are extracted right away."""
+    groups = {}
+    names = set()
+    for instance in dg.object_instances:
+        if not instance.is_instance or instance.object.type != 'MESH':
+            continue
+        source = instance.object
+        key = source.data.as_pointer()
+        group = groups.get(key)
+        if group is None:
+            mesh = source.to_mesh()
+            if not mesh.loop_triangles and mesh.polygons:
+                mesh.calc_loop_triangles()
+            mesh_data = mesh_export.extract_mesh(mesh)
+            mesh = None
+            source.to_mesh_clear()
 
-def export_objects(parent, filepath, scene, frameNumber):
+            # Different meshes may have the same name (e.g. generated by geometry nodes)
+            name = f"{source.name}_{source.data.name}"
+            k = 1
+            while name in names:
+                name = f"{source.name}_{source.data.name}.{k}"
+                k += 1
+            names.add(name)
+            group = groups[key] = {
+                "name" : name,
+                "materials" : [slot.material for slot in source.material_slots],
+                "mesh_data" : mesh_data,
+                "matrices" : []
+            }
+        # Flat list of the matrix values (converted to an array much faster than matrices)
+        for row in instance.matrix_world:
+            group["matrices"].extend(row)
+    return list(groups.values())
+
+def instance_entry(name, material, filename, sidecars, transforms, offset, count):
+    """Return the scene entry of a shape drawn at count transforms of the transform buffer (from offset)"""
+    shape_data = {}
+    shape_data["type"] = "instances"
+    shape_data["name"] = name
+    shape_data["filename"] = filename
+    if sidecars:
+        shape_data.update(sidecars)
+    shape_data["material"] = material
+    shape_data["transforms"] = {
+        "filename" : transforms,
+        "offset" : offset,
+        "count" : count
+    }
+    return shape_data
+
+def export_instances(parent, filepath, scene, frameNumber, dg, pipeline, manifest, shapes, materials, radiances, emitters=None):
+    """Export each instanced mesh once, and the matrices of all its instances to one transform buffer
+    (instances/<hash>.xform: float32 4x4 row-major matrices), return the number of instances"""
+    with export_metrics.phase("depsgraph"):
+        groups = collect_instances(dg)
+    if len(groups) == 0:
+        return 0
+
+    # The buffer is named after its content: frames where no instance moves share it
+    with export_metrics.phase("instances"):
+        matrices = np.concatenate([np.array(group["matrices"], dtype="<f4") for group in groups])
+        digest = hashlib.blake2b(matrices.tobytes(), digest_size=16).hexdigest()
+    transformsRel = 'instances/' + digest + '.xform'
+    manifest.record(frameNumber, "instances:transforms", digest, [(0, transformsRel, {})])
+    offset = 0
+    for group in groups:
+        name = group["name"]
+        mesh_data = group["mesh_data"]
+        with export_metrics.phase("materials"):
+            for material in group["materials"]:
+                if material is not None and material.name not in exportedMaterials:
+                    mats = export_material_cached(parent, scene, material, filepath)
+                    materials += mats
+                    radiances.update(emitter_radiances(mats))
+                    exportedMaterials.add(material.name)
+        if export_metrics.current is not None:
+            export_metrics.current.add_object(name, len(mesh_data["tri_materials"]))
+
+        slots = emitter_slots(scene, group["materials"], radiances)
+        fingerprint = mesh_export.mesh_fingerprint(mesh_data, mesh_settings(scene, None, slots), [], [material.name if material is not None else None for material in group["materials"]])
+        exported = None if scene.reexport_geometry else manifest.lookup(frameNumber, "instances:" + name, fingerprint)
+        if exported is None:
+            exported = export_shapes(parent, filepath, scene, frameNumber, pipeline, name, mesh_data, max(len(group["materials"]), 1), None, slots)
+        manifest.record(frameNumber, "instances:" + name, fingerprint, exported)
+
+        count = len(group["matrices"]) // 16
+        if emitters is not None and len(slots) != 0:
+            scale = light_sampling.area_scales(np.array(group["matrices"], dtype=np.float64).reshape(-1, 4, 4)).sum()
+        for (i, objFilePathRel, sidecars) in exported:
+            material = group["materials"][i] if i < len(group["materials"]) else None
+            if emitters is not None and i in slots:
+                # All the instances of the slot are one emitter
+                emitters.append((len(shapes), light_sampling.emitted_power(radiances[material.name], light_sampling.slot_area(mesh_data, i) * scale)))
+            shapes.append(instance_entry(name, material.name if material is not None else "DEFAULT",
+                objFilePathRel, sidecars, transformsRel, offset, count))
+        offset += count
+        group["mesh_data"] = None
+
+    # One buffer for all the instances of the frame
+    with export_metrics.phase("instances"):
+        transformsPath = bpy.path.abspath(filepath + './' + transformsRel)
+        if not os.path.exists(transformsPath):
+            os.makedirs(os.path.dirname(transformsPath), exist_ok=True)
+            tmp = mesh_export.temporary_path(transformsPath)
+            matrices.tofile(tmp)
+            os.replace(tmp, transformsPath)
+            if export_metrics.current is not None:
+                export_metrics.current.add_file(None, transformsPath)
+    parent.report({'INFO'}, f"Instancers: {len(groups)} instanced meshes, {offset} instances")
+    return offset
+
+def write_shape(metrics, name, path, mesh_format, positions, normals, uvs, indices, position_bits=16, bvh_path=None, cdf_path=None):
+    """Write a mesh file (in a pipeline worker) and account its size
+
+    With bvh_path, the BVH is built first and the triangles are written in the order of its leaves.
+    With cdf_path, the area CDF of the triangles (in the order of the file) is written for emitter sampling.
+    """
+    if bvh_path is not None:
+        (nodes, order) = mesh_bvh.build_bvh(positions, indices)
+        indices = indices[order]
+        # The sidecar is complete before the mesh file appears
+        mesh_bvh.write_bvh(bvh_path, nodes, len(indices))
+        if metrics is not None:
+            metrics.add_file(name, bvh_path)
+    if cdf_path is not None:
+        light_sampling.write_triangle_cdf(cdf_path, positions, indices)
+        if metrics is not None:
+            metrics.add_file(name, cdf_path)
+    mesh_export.write_mesh(path, mesh_format, positions, normals, uvs, indices, position_bits)
+    if metrics is not None:
+        metrics.add_file(name, path)
+
+def export_shapes(parent, filepath, scene, frameNumber, pipeline, name, mesh_data, nb_slots, lod=None, emitters=()):
+    """Schedule the writing of one mesh per non-empty material slot, return [(slot, filename, {sidecar : filename})]
+    (lod: cell size of the decimation, None to keep the full mesh, emitters: the slots with an emission material)"""
+    exported = []
+    with export_metrics.phase("mesh_buffers"):
+        for i in range(nb_slots):
+            # Skip the slots without any triangle
+            nb_tris = len(mesh_export.material_triangles(mesh_data, i))
+            if nb_tris == 0:
+                export_metrics.log(parent, f"Skipping empty material slot: {i}", {'DEBUG'})
+                continue
+
+            # Create ouput directory
+            meshFolder = 'meshes/shared/' if shares_geometry(scene) else 'meshes/' + frameNumber + '/'
+            objFolderPath =  bpy.path.abspath(filepath + './' + meshFolder)
+            if not os.path.exists(objFolderPath):
+                parent.report({"INFO"},f'Meshes directory did not exist, creating: {objFolderPath}')
+                os.makedirs(objFolderPath)
+
+            # Decimated shapes are gathered first: they may not have any triangle left
+            shape = None
+            if lod is not None:
+                shape = mesh_export.decimate_shape(*mesh_export.gather_shape(mesh_data, i), lod)
+                if len(shape[3]) == 0:
+                    export_metrics.log(parent, f"Skipping material slot without triangles after decimation: {i}", {'DEBUG'})
+                    continue
+
+            if shares_geometry(scene):
+                # Shared geometry is named after its content: identical shapes are written once
+                if shape is None:
+                    shape = mesh_export.gather_shape(mesh_data, i)
+                # The triangles of shapes with a BVH are reordered and emitters have a CDF: they do not share the files of the others
+                formatKey = mesh_export.format_key(scene.mesh_format, scene.position_bits) + ("+bvh" if scene.export_bvh else "") + ("+emitter" if i in emitters else "")
+                objName = mesh_export.shape_hash(formatKey, *shape) + mesh_export.MESH_EXTENSIONS[scene.mesh_format]
+            else:
+                objName = name + f'_mat{i}' + ('_lod' if lod is not None else '') + mesh_export.MESH_EXTENSIONS[scene.mesh_format]
+                objName = objName.replace(":","_")
+            objFilePath = objFolderPath + objName
+            objFilePathRel = meshFolder + objName
+            bvhFilePath = mesh_bvh.bvh_filename(objFilePath) if scene.export_bvh else None
+            cdfFilePath = light_sampling.cdf_filename(objFilePath) if i in emitters else None
+            sidecars = {}
+            if bvhFilePath is not None:
+                sidecars["bvh"] = mesh_bvh.bvh_filename(objFilePathRel)
+            if cdfFilePath is not None:
+                sidecars["emitter"] = light_sampling.cdf_filename(objFilePathRel)
+
+            # Export obj manually
+            if objFilePath in pipeline.files:
+                export_metrics.log(parent, f"Skipping file already exported: {objFilePath}")
+            elif os.path.exists(objFilePath) and shares_geometry(scene) and all(os.path.exists(path) for path in (bvhFilePath, cdfFilePath) if path is not None):
+                export_metrics.log(parent, f"Skipping existing file: {objFilePath}")
+            else:
+                export_metrics.log(parent, f"Exporting file: {objFilePath}")
+                if shape is None:
+                    shape = mesh_export.gather_shape(mesh_data, i)
+                (positions, normals, uvs, indices) = shape
+                export_metrics.log(parent, f"Exporting - Nb Tri: {nb_tris}", {'DEBUG'})
+                export_metrics.log(parent, f"Welded vertices: {indices.size} -> {len(positions)} ({indices.size / len(positions):.2f}x reduction)")
+                with export_metrics.phase("mesh_writing_wait"):
+                    pipeline.write(objFilePath, write_shape, export_metrics.current, name, objFilePath, scene.mesh_format, positions, normals, uvs, indices, scene.position_bits, bvhFilePath, cdfFilePath)
+
+            exported.append((i, objFilePathRel, sidecars))
+    return exported
+
+def run_steps(steps):
+    """Run an export generator to completion, return its result"""
+    while True:
+        try:
+            next(steps)
+        except StopIteration as stop:
+            return stop.value
+
+def export_objects(parent, filepath, scene, frameNumber, shapes=None):
+    """Export the meshes, the shape entries are appended to shapes (a new list if None)"""
+    return run_steps(export_objects_steps(parent, filepath, scene, frameNumber, shapes))
+
+def export_objects_steps(parent, filepath, scene, frameNumber, shapes=None, emitters=None, visibility=None):
+    """Generator version of export_objects: yields (objects exported, object count) before each object
+    and returns (shapes, materials)
+
+    emitters (optional list) receives (shape index, power) for each shape with an emission material.
+    visibility (optional, see camera_culling.range_visibility) replaces the culling tests of the frame.
+    """
     materials = [
         {"type" : "diffuse", "name" : "DEFAULT", "albedo" : [0.8, 0.8, 0.8]}
     ]
-    shapes = []
+    radiances = {}
+    if shapes is None:
+        shapes = []
     
+    # Objects outside of the camera view or too small on screen are skipped (or decimated)
+    frustum = None
+    if (scene.frustum_culling or scene.lod_pixels > 0) and visibility is None:
+        frustum = camera_culling.camera_frustum(scene, scene.culling_margin)
+    lods = {}
+    culled = []
+
     # Compute the objects to export
     objects = []
     total = 0
     for object in scene.objects:
         if object.hide_render:
-            parent.report({'INFO'}, f"Skipping hidden object: {object.name}")
+            export_metrics.log(parent, f"Skipping hidden object: {object.name}")
             continue
         if object is not None and object.type == 'MESH':
+            if visibility is not None:
+                # Same objects and levels of detail for all the frames of an animation
+                (inside, pixels) = visibility.get(object.name, (True, math.inf))
+            elif frustum is not None:
+                corners = camera_culling.object_corners(object)
+                (inside, pixels) = (frustum.inside(corners), frustum.screen_size(corners))
+            if visibility is not None or frustum is not None:
+                if scene.frustum_culling and not inside:
+                    culled.append((object.name, "skipped", "outside of the camera frustum"))
+                    continue
+                if pixels < scene.lod_pixels:
+                    if scene.lod_mode == 'skip':
+                        culled.append((object.name, "skipped", f"{pixels:.1f} pixels on screen"))
+                        continue
+                    # Grid of about one cell per pixel covered by the object
+                    culled.append((object.name, "decimated", f"{pixels:.1f} pixels on screen"))
+                    lods[object.name] = camera_culling.local_size(object) / max(pixels, 1.0)
             objects.append(object)
             total += 1
+
+    for (name, action, reason) in culled:
+        export_metrics.log(parent, f"Culling object ({action}): {name}, {reason}")
+        if export_metrics.current is not None:
+            export_metrics.current.add_culled(frameNumber, name, action, reason)
+    if len(culled) != 0:
+        skipped = sum(1 for (_, action, _) in culled if action == "skipped")
+        parent.report({'INFO'}, f"Camera culling: {skipped} objects skipped, {len(culled) - skipped} decimated")
     
     # Get the window manager
     wm = bpy.context.window_manager
     wm.progress_begin(0, total)
-        
-    
-    for (j, object) in enumerate(objects):
-        # Export the object
-        parent.report({'INFO'}, f"Exporting Object: {object.name}")
-        wm.progress_update(j)
-        
-        # Apply modifiers
+
+    # Evaluate the depsgraph once for all the objects (apply modifiers)
+    frame = scene.frame_current
+    with export_metrics.phase("depsgraph"):
         bpy.ops.object.mode_set(mode='OBJECT')
         bpy.context.view_layer.update()
-        object.data.update()
         dg = bpy.context.evaluated_depsgraph_get()
-        eval_obj = object.evaluated_get(dg)
-        mesh = eval_obj.to_mesh()
-        if not mesh.loop_triangles and mesh.polygons:
-            parent.report({'INFO'}, " loop triangles...")
-            mesh.calc_loop_triangles()
-
-        for i in range(max(len(object.material_slots), 1)):    
-            # Export the material if needed
-            if len(object.material_slots) != 0:
-                material = object.material_slots[i].material
-                if material.name not in exportedMaterials:
-                    materials += export_material(parent, scene, material, filepath)
-                    exportedMaterials.append(material.name)
-                
-        
-            # Create ouput directory
-            objFolderPath =  bpy.path.abspath(filepath + './meshes/' + frameNumber + '/')
-            if not os.path.exists(objFolderPath):
-                parent.report({"INFO"},f'Meshes directory did not exist, creating: {objFolderPath}')
-                os.makedirs(objFolderPath)
+    
+    # Geometry files of the linked duplicates already exported (mesh datablock -> ([(slot, filename, sidecars)], slot areas))
+    prototypes = {}
+    nb_instances = 0
 
-            # Compute the path variables
-            objName = object.name + f'_mat{i}.obj' 
-            objName = objName.replace(":","_")
-            objFilePath = objFolderPath + objName
-            objFilePathRel = 'meshes/' + frameNumber + '/' + objName
+    # Mesh files are formatted and written by the pipeline workers
+    pipeline = export_pool.ExportPipeline(scene.export_workers)
 
-            # Export obj manually
-            indices = []
-            normals = []
-            if os.path.exists(objFilePath) and not scene.reexport_geometry:
-                parent.report({'INFO'}, f"Skipping existing file: {objFilePath}")
-            else:
-                parent.report({'INFO'}, f"Exporting file: {objFilePath}")
-                for loop_tri in mesh.loop_triangles:
-                    polygon = mesh.polygons[loop_tri.polygon_index]
-                    if polygon.material_index == i:
-                        for loop_index in loop_tri.loops:
-                            vertex_index = mesh.loops[loop_index].vertex_index
-                            indices.append(vertex_index)
-                            normals.append(mesh.loops[loop_index].normal)
-                parent.report({'DEBUG'}, f"Exporting - Nb Tri: {len(indices) // 3}") 
-                if(len(indices) == 0):
-                    continue 
-                write_obj(objFilePath, mesh, indices, normals, i)
-
-            # Create entry
-            # TODO: Manage participating media
-            #exportObject_medium(scene_file, object.material_slots[0].material)
-            shape_data = {}
-            shape_data["type"] = "mesh"
-            shape_data["filename"] = objFilePathRel
-            if len(object.material_slots) != 0:
-                shape_data["material"] = object.material_slots[i].material.name
+    # Objects unchanged since the last export of the frame are not written again
+    manifest = export_manifest.open_manifest(filepath)
+    nb_unchanged = 0
+
+    try:
+        for (j, object) in enumerate(objects):
+            # Export the object
+            yield (j, len(objects))
+
+            # The UI runs between the steps of a modal export: the timeline may have moved
+            # (all the objects of the scene file must be evaluated at the same frame) and objects may be deleted
+            if scene.frame_current != frame:
+                export_metrics.log(parent, f"Frame changed during the export, going back to frame {frame}")
+                with export_metrics.phase("depsgraph"):
+                    scene.frame_set(frame)
+                    bpy.context.view_layer.update()
+                    dg = bpy.context.evaluated_depsgraph_get()
+            if object_removed(object):
+                parent.report({'WARNING'}, "Object deleted during the export, skipped")
+                parent.error_or_warning = True
+                continue
+            export_metrics.log(parent, f"Exporting Object: {object.name}")
+            wm.progress_update(j)
+
+            # Export the materials if needed
+            with export_metrics.phase("materials"):
+                for slot in object.material_slots:
+                    material = slot.material
+                    if material.name not in exportedMaterials:
+                        mats = export_material_cached(parent, scene, material, filepath)
+                        materials += mats
+                        radiances.update(emitter_radiances(mats))
+                        exportedMaterials.add(material.name)
+            slotMaterials = [slot.material for slot in object.material_slots]
+            slots = emitter_slots(scene, slotMaterials, radiances)
+
+            # Linked duplicates reuse the geometry of the first exported object (but not its decimated version)
+            # with the same emitter slots (object linked materials can make only some of them emissive)
+            prototype = instance_key(object) if object.name not in lods else None
+            if prototype is not None:
+                prototype = (prototype, frozenset(slots))
+            if prototype in prototypes:
+                export_metrics.log(parent, f"Instancing shared mesh: {object.data.name}")
+                (exported, areas) = prototypes[prototype]
+                if emitters is not None and len(areas) != 0:
+                    scale = light_sampling.area_scales(np.array(object.matrix_world, dtype=np.float64)[None])[0]
+                for (i, objFilePathRel, sidecars) in exported:
+                    if emitters is not None and i in slots:
+                        emitters.append((len(shapes), light_sampling.emitted_power(radiances[slotMaterials[i].name], areas[i] * scale)))
+                    shapes.append(shape_entry(object, i, objFilePathRel, sidecars))
+                nb_instances += 1
+                continue
+        
+            # Copy the evaluated mesh and release it right away
+            with export_metrics.phase("depsgraph"):
+                eval_obj = object.evaluated_get(dg)
+                mesh = eval_obj.to_mesh()
+            with export_metrics.phase("triangulation"):
+                if not mesh.loop_triangles and mesh.polygons:
+                    export_metrics.log(parent, " loop triangles...")
+                    mesh.calc_loop_triangles()
+                mesh_data = mesh_export.extract_mesh(mesh)
+                mesh = None
+                eval_obj.to_mesh_clear()
+            if export_metrics.current is not None:
+                export_metrics.current.add_object(object.name, len(mesh_data["tri_materials"]))
+
+            lod = lods.get(object.name)
+            fingerprint = object_fingerprint(scene, object, mesh_data, lod, slots)
+            exported = None if scene.reexport_geometry else manifest.lookup(frameNumber, object.name, fingerprint)
+            if exported is not None:
+                # Unchanged since the last export of the frame: reuse its files
+                export_metrics.log(parent, f"Object unchanged since the last export: {object.name}")
+                nb_unchanged += 1
             else:
-                # Use the default material
-                shape_data["material"] = "DEFAULT"
-            
-            matrix =  object.matrix_world # transposed()
-            shape_data["transform"] = {
-                "matrix" : [
-                    matrix[0][0],matrix[0][1],matrix[0][2],matrix[0][3],
-                    matrix[1][0],matrix[1][1],matrix[1][2],matrix[1][3],
-                    matrix[2][0],matrix[2][1],matrix[2][2],matrix[2][3],
-                    matrix[3][0],matrix[3][1],matrix[3][2],matrix[3][3]
-                ]
-            }                
-            shapes += [shape_data]
+                exported = export_shapes(parent, filepath, scene, frameNumber, pipeline, object.name, mesh_data, max(len(object.material_slots), 1), lod, slots)
+            for (i, objFilePathRel, sidecars) in exported:
+                if emitters is not None and i in slots:
+                    area = light_sampling.slot_area(mesh_data, i, object.matrix_world)
+                    emitters.append((len(shapes), light_sampling.emitted_power(radiances[slotMaterials[i].name], area)))
+                shapes.append(shape_entry(object, i, objFilePathRel, sidecars))
+            manifest.record(frameNumber, object.name, fingerprint, exported)
+
+            if prototype is not None:
+                # Object space area of the emitters, scaled by the transform of each duplicate
+                areas = {i : light_sampling.slot_area(mesh_data, i) for i in slots} if emitters is not None else {}
+                prototypes[prototype] = (exported, areas)
+            del mesh_data
+
+        # Instances of the particle systems, geometry nodes and collection instances
+        if scene.export_instancers:
+            export_instances(parent, filepath, scene, frameNumber, dg, pipeline, manifest, shapes, materials, radiances, emitters)
+    except BaseException:
+        # Cancelled (or failed): drop the pending writes, the mesh files are either complete or absent
+        pipeline.cancel()
+        wm.progress_end()
+        raise
+
+    if nb_instances != 0:
+        parent.report({'INFO'}, f"Instanced objects: {nb_instances}")
+    if nb_unchanged != 0:
+        parent.report({'INFO'}, f"Unchanged objects: {nb_unchanged}")
+
+    with export_metrics.phase("mesh_writing_wait"):
+        stats = pipeline.close()
+    if export_metrics.current is not None:
+        # Cumulated time of the writer threads
+        export_metrics.current.add_time("mesh_writing", stats["write_time"])
+    manifest.commit_frame(frameNumber)
+    parent.report({'INFO'}, f"Mesh writing: {stats['files']} files, {stats['workers']} workers, write {stats['write_time']:.2f}s, waited {stats['wait_time']:.2f}s, overlap {stats['overlap'] * 100:.0f}%")
+    parent.report({'INFO'}, f"Memory after {len(objects)} objects: {export_metrics.format_memory(export_metrics.memory_usage())}")
     wm.progress_end()
 
     return (shapes, materials)
@@ -529,7 +982,14 @@ def export_background(parent, scene, filepath):
     node = outputNode.inputs[0].links[0].from_node
     if node.bl_idname == "ShaderNodeBackground":
         if scene.envmap:
-            return texture_or_value(parent, node.inputs[0], filepath)
+            background = texture_or_value(parent, node.inputs[0], filepath)
+            links = node.inputs[0].links
+            if scene.envmap_sampling and len(links) != 0 and links[0].from_node.bl_idname == "ShaderNodeTexEnvironment":
+                # Marginal and conditional CDFs precomputed for the renderer
+                sampling = envmap_distribution(parent, links[0].from_node, filepath, scene.envmap_sampling_resolution)
+                if sampling is not None:
+                    background["sampling"] = sampling
+            return background
         else: 
             return only_value(parent, node.inputs[0])
     else:
@@ -537,12 +997,21 @@ def export_background(parent, scene, filepath):
         parent.error_or_warning = True
         return [0.0, 0.0, 0.0]
 
-def export_renderer(parent, filepath, scene , frameNumber):
+def output_directory(parent, filepath):
     if filepath == "":
         filepath = os.path.dirname(bpy.data.filepath)
         parent.report({'WARNING'}, f"No output directory, using default: {filepath}")
     else:
         parent.report({'INFO'}, f"Exporting to: {filepath}")
+    return filepath
+
+def export_renderer(parent, filepath, scene , frameNumber, keep_shapes=False):
+    """Export the scene file of the frame, return its content (the shapes only if keep_shapes)"""
+    return run_steps(export_renderer_steps(parent, filepath, scene, frameNumber, keep_shapes))
+
+def export_renderer_steps(parent, filepath, scene , frameNumber, keep_shapes=False, visibility=None):
+    """Generator version of export_renderer (yields the progress of export_objects_steps)"""
+    filepath = output_directory(parent, filepath)
 
     # Create output directory
     out = os.path.join(filepath, "test" + frameNumber +".json")
@@ -561,18 +1030,240 @@ def export_renderer(parent, filepath, scene , frameNumber):
     # Clear lsit of cached texture and materials
     exportedMaterials.clear()
 
-    with open(out, 'w') as scene_file:
-        data_all ={}
+    # The scene is streamed to a temporary file: shapes are written as soon as they are exported
+    try:
+        with open(out + ".tmp", 'w') as scene_file:
+            data_all ={}
+            writer = scene_writer.SceneWriter(scene_file, scene.compact_json)
         
-        data_all["background"] = export_background(parent, scene, filepath)
-        data_all["integrator"] = export_integrator(parent, scene)
-        (camera, sampler) = export_camera(parent, scene)
-        data_all["camera"] = camera
-        data_all["sampler"] = sampler
-        (shapes, materials) = export_objects(parent, filepath, scene, frameNumber)
-        data_all["materials"] = materials
-        data_all["shapes"] = shapes
-
-        exported_json_string = json.dumps(data_all, indent=4)
-        scene_file.write(exported_json_string)
-        scene_file.close()
+            with export_metrics.phase("background"):
+                data_all["background"] = export_background(parent, scene, filepath)
+            writer.write("background", data_all["background"])
+            data_all["integrator"] = export_integrator(parent, scene)
+            writer.write("integrator", data_all["integrator"])
+            with export_metrics.phase("camera"):
+                (camera, sampler) = export_camera(parent, scene)
+            data_all["camera"] = camera
+            data_all["sampler"] = sampler
+            writer.write("camera", camera)
+            writer.write("sampler", sampler)
+            shapes = writer.begin_list("shapes", keep=keep_shapes)
+            emitters = [] if scene.export_emitters else None
+            (shapes, materials) = yield from export_objects_steps(parent, filepath, scene, frameNumber, shapes, emitters, visibility)
+            writer.end_list()
+            data_all["materials"] = materials
+            data_all["shapes"] = shapes.items
+            writer.write("materials", materials)
+
+            # Power of the emissive shapes, to pick the light to sample
+            if emitters:
+                with export_metrics.phase("emitters"):
+                    data_all["emitters"] = export_emitters(parent, filepath, frameNumber, emitters)
+                writer.write("emitters", data_all["emitters"])
+
+            # Wait for the texture copies
+            with export_metrics.phase("textures"):
+                texture_store.close_store(bpy.path.abspath(filepath + '/textures/'))
+
+            writer.close()
+    except BaseException:
+        # Cancelled (or failed): no partial scene file is left behind
+        texture_store.close_store(bpy.path.abspath(filepath + '/textures/'))
+        if os.path.exists(out + ".tmp"):
+            os.remove(out + ".tmp")
+        raise
+    os.replace(out + ".tmp", out)
+    if export_metrics.current is not None:
+        export_metrics.current.add_file(None, out)
+    return data_all
+
+def export_emitters(parent, filepath, frameNumber, emitters):
+    """Write the emitter table of the frame (lights/<frame>.emitters), return its scene entry"""
+    emittersRel = 'lights/' + frameNumber + '.emitters'
+    emittersPath = bpy.path.abspath(filepath + './' + emittersRel)
+    total = light_sampling.write_emitter_table(emittersPath, emitters)
+    if export_metrics.current is not None:
+        export_metrics.current.add_file(None, emittersPath)
+    parent.report({'INFO'}, f"Emitters: {len(emitters)} shapes, total power {total:.3g}")
+    return {
+        "filename" : emittersRel,
+        "count" : len(emitters),
+        "power" : total
+    }
+
+def shape_keys(shapes):
+    """Identify the shapes of a frame by (object name, index of the shape inside the object)"""
+    counts = {}
+    keys = []
+    for shape in shapes:
+        k = counts.get(shape["name"], 0)
+        counts[shape["name"]] = k + 1
+        keys.append((shape["name"], k))
+    return keys
+
+def export_animation(parent, filepath, scene, frameStart, frameEnd):
+    """Export the first frame as the base scene, then only what changes in the following frames
+    (camera, shape transforms/geometry and materials) as tracks in animation.json"""
+    run_steps(export_animation_steps(parent, filepath, scene, frameStart, frameEnd))
+
+def export_animation_steps(parent, filepath, scene, frameStart, frameEnd):
+    """Generator version of export_animation (yields the progress of export_objects_steps)"""
+    frameStartTime = time.perf_counter()
+
+    # An object is culled only if it is culled at every frame: the base scene holds all the shapes of the animation
+    visibility = None
+    if scene.frustum_culling or scene.lod_pixels > 0:
+        with export_metrics.phase("culling"):
+            visibility = camera_culling.range_visibility(scene, frameStart, frameEnd, scene.culling_margin)
+
+    scene.frame_set(frameStart)
+    print("Exporting frame: %s" % (frameStart))
+    baseName = "test" + '{0:05d}'.format(frameStart) + ".json"
+    base = yield from export_renderer_steps(parent, filepath, scene, '{0:05d}'.format(frameStart), keep_shapes=True, visibility=visibility)
+    if export_metrics.current is not None:
+        export_metrics.current.add_frame(frameStart, time.perf_counter() - frameStartTime)
+    filepath = output_directory(parent, filepath)
+
+    shapeIndices = {key : index for (index, key) in enumerate(shape_keys(base["shapes"]))}
+    previousShapes = list(base["shapes"])
+    # Base shapes hidden or deleted at the previous frame
+    hidden = set()
+    previousCamera = base["camera"]
+    previousMaterials = {material["name"] : material for material in base["materials"]}
+    cameraTrack = []
+    shapeTracks = {}
+    materialTrack = []
+    # Emitter table of the base scene (powers compared in float32, as they are stored)
+    previousEmitters = []
+    emitterTrack = []
+    if "emitters" in base:
+        (indices, powers, _, _) = light_sampling.read_emitter_table(bpy.path.abspath(filepath + './' + base["emitters"]["filename"]))
+        previousEmitters = list(zip(indices.tolist(), powers.tolist()))
+
+    try:
+        for frameNumber in range(frameStart + 1, frameEnd + 1):
+            frameStartTime = time.perf_counter()
+            scene.frame_set(frameNumber)
+            print("Exporting frame: %s" % (frameNumber))
+            exportedMaterials.clear()
+
+            with export_metrics.phase("camera"):
+                (camera, sampler) = export_camera(parent, scene)
+            if camera != previousCamera:
+                cameraTrack.append({"frame" : frameNumber, **camera})
+                previousCamera = camera
+
+            emitters = [] if scene.export_emitters else None
+            (shapes, materials) = yield from export_objects_steps(parent, filepath, scene, '{0:05d}'.format(frameNumber), emitters=emitters, visibility=visibility)
+            keys = shape_keys(shapes)
+            present = set()
+            for (key, shape) in zip(keys, shapes):
+                index = shapeIndices.get(key)
+                if index is None:
+                    parent.report({'WARNING'}, f"Shape not in the base scene, ignored in the animation: {key[0]}")
+                    parent.error_or_warning = True
+                    continue
+                present.add(index)
+                changes = {field : shape[field] for field in ("filename", "bvh", "emitter", "material", "transform", "transforms") if shape.get(field) != previousShapes[index].get(field)}
+                if index in hidden:
+                    changes["visible"] = True
+                    hidden.discard(index)
+                if len(changes) != 0:
+                    shapeTracks.setdefault(str(index), []).append({"frame" : frameNumber, **changes})
+                    previousShapes[index] = shape
+            # Base shapes missing from the frame (hidden or deleted objects)
+            for index in range(len(previousShapes)):
+                if index not in present and index not in hidden:
+                    shapeTracks.setdefault(str(index), []).append({"frame" : frameNumber, "visible" : False})
+                    hidden.add(index)
+
+            # A new emitter table (indexing the base shapes) when the emitted powers change
+            if emitters is not None:
+                table = [(shapeIndices[keys[index]], power) for (index, power) in emitters if keys[index] in shapeIndices]
+                stored = [(index, float(np.float32(power))) for (index, power) in table]
+                if stored != previousEmitters:
+                    with export_metrics.phase("emitters"):
+                        entry = export_emitters(parent, filepath, '{0:05d}'.format(frameNumber), table)
+                    emitterTrack.append({"frame" : frameNumber, **entry})
+                    previousEmitters = stored
+
+            for material in materials:
+                if previousMaterials.get(material["name"]) != material:
+                    materialTrack.append({"frame" : frameNumber, "material" : material})
+                    previousMaterials[material["name"]] = material
+            if export_metrics.current is not None:
+                export_metrics.current.add_frame(frameNumber, time.perf_counter() - frameStartTime)
+    except BaseException:
+        # Cancelled (or failed): animation.json is not written
+        texture_store.close_store(bpy.path.abspath(filepath + '/textures/'))
+        raise
+
+    # Wait for the texture copies
+    with export_metrics.phase("textures"):
+        texture_store.close_store(bpy.path.abspath(filepath + '/textures/'))
+
+    animation = {
+        "scene" : baseName,
+        "frame_start" : frameStart,
+        "frame_end" : frameEnd,
+        "camera" : cameraTrack,
+        "shapes" : shapeTracks,
+        "materials" : materialTrack,
+        "emitters" : emitterTrack
+    }
+    with open(os.path.join(filepath, "animation.json"), 'w') as animation_file:
+        animation_file.write(json.dumps(animation, separators=(",", ":")))
+    parent.report({'INFO'}, f"Animation tracks: camera {len(cameraTrack)} keys, {len(shapeTracks)} animated shapes, {len(materialTrack)} material changes, {len(emitterTrack)} emitter tables")
+
+
+def export_frames(parent, filepath, scene, frameStart, frameEnd, metricsPath=None, manifestPath=None):
+    """Export a frame range (one scene file per frame, or a base scene and tracks in animation mode)
+    The timings are written to metrics.json (or metricsPath), return the metrics.
+    With manifestPath, the manifest of the exported frames is saved there instead of export_manifest.json."""
+    return run_steps(export_frames_steps(parent, filepath, scene, frameStart, frameEnd, metricsPath, manifestPath))
+
+def export_frames_steps(parent, filepath, scene, frameStart, frameEnd, metricsPath=None, manifestPath=None):
+    """Generator version of export_frames: yields (objects exported, object count) of the current frame
+    before each object, the frames done are in export_metrics.current.frames
+
+    Closing the generator cancels the export: the pending mesh writes are dropped and only complete
+    files are left (mesh, texture and scene files are written to temporary files first)."""
+    metrics = export_metrics.start_export(scene.verbose_log)
+
+    # The material cache only lives for one batch
+    materialCache.clear()
+
+    # Texture resolutions are chosen once (at the first frame) so the reduced copies are shared by all the frames
+    scene.frame_set(frameStart)
+    textureSizes.clear()
+    textureSizes.update(plan_textures(parent, scene))
+
+    directory = filepath if filepath != "" else os.path.dirname(bpy.data.filepath)
+    try:
+        if scene.export_animation and frameEnd > frameStart:
+            yield from export_animation_steps(parent, filepath, scene, frameStart, frameEnd)
+        else:
+            for frameNumber in range(frameStart, frameEnd +1):
+                frameStartTime = time.perf_counter()
+                scene.frame_set(frameNumber)
+                print("Exporting frame: %s" % (frameNumber))
+                yield from export_renderer_steps(parent, filepath, scene, '{0:05d}'.format(frameNumber))
+                metrics.add_frame(frameNumber, time.perf_counter() - frameStartTime)
+    except BaseException:
+        # Keep the frames completed before the cancellation
+        export_manifest.close_manifest(directory, prune_files=False, path=manifestPath)
+        raise
+    finally:
+        textureSizes.clear()
+        export_metrics.stop_export()
+
+    # Remove the mesh files that the exported frames do not use anymore
+    removed = export_manifest.close_manifest(directory, scene.prune_meshes, manifestPath)
+    if len(removed) != 0:
+        parent.report({'INFO'}, f"Removed {len(removed)} mesh files not used anymore")
+        for filename in removed:
+            export_metrics.log(parent, f"Removed unused file: {filename}")
+
+    metrics.write(metricsPath or os.path.join(directory, "metrics.json"))
+    parent.report({'INFO'}, metrics.summary())
+    return metrics
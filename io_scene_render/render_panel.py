@@ -1,6 +1,8 @@
 import bpy
 import os
+import time
 from . import render_exporter
+from . import export_metrics
 
 class ExportRendererScene(bpy.types.Operator):
     bl_idname = 'scene.export'
@@ -11,8 +13,12 @@ class ExportRendererScene(bpy.types.Operator):
     # Error handling
     fatal_error = False
     error_or_warning = False
+
+    # Export time per timer event, the UI is refreshed in between
+    TICK_DURATION = 0.1
     
-    def execute(self, context):
+    def start(self, context):
+        """Return the export generator of the scene (one step per object)"""
         # Get the scene and abs path (if provided)
         currentScene = bpy.context.scene
         exportPath = bpy.path.abspath(currentScene.exportpath)
@@ -20,12 +26,12 @@ class ExportRendererScene(bpy.types.Operator):
         # Reset error handling
         self.error_or_warning = False
         self.fatal_error = False
-        
-        for frameNumber in range(currentScene.batch_frame_start, currentScene.batch_frame_end +1):
-            currentScene.frame_set(frameNumber)
-            print("Exporting frame: %s" % (frameNumber))
-            render_exporter.export_renderer(self, exportPath, currentScene, '{0:05d}'.format(frameNumber))
-            
+        self.nb_frames = currentScene.batch_frame_end - currentScene.batch_frame_start + 1
+        self.progress = (0, 0)
+
+        return render_exporter.export_frames_steps(self, exportPath, currentScene, currentScene.batch_frame_start, currentScene.batch_frame_end)
+
+    def finish(self):
         # Check if there was an error during export
         if self.error_or_warning:
             if self.fatal_error:
@@ -36,6 +42,60 @@ class ExportRendererScene(bpy.types.Operator):
             self.report({'INFO'}, "Export complete.")
         return {"FINISHED"}
 
+    def execute(self, context):
+        # Blocking export (scripts)
+        render_exporter.run_steps(self.start(context))
+        return self.finish()
+
+    def invoke(self, context, event):
+        # Export from timer events so that the UI stays responsive (Esc cancels)
+        self.steps = self.start(context)
+        wm = context.window_manager
+        self.timer = wm.event_timer_add(0.01, window=context.window)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def stop(self, context):
+        context.window_manager.event_timer_remove(self.timer)
+        context.workspace.status_text_set(None)
+
+    def status(self):
+        """Frames and objects remaining and throughput of the running export"""
+        metrics = export_metrics.current
+        if metrics is None:
+            return ""
+        elapsed = max(time.perf_counter() - metrics.start, 1e-6)
+        triangles = sum(o["triangles"] for o in metrics.objects.values())
+        (objects_done, objects) = self.progress
+        return (f"Exporting frame {min(len(metrics.frames) + 1, self.nb_frames)}/{self.nb_frames}, "
+            f"{objects - objects_done} objects remaining in the frame, "
+            f"{triangles / elapsed / 1e6:.2f} Mtris/s, {metrics.bytes_written / elapsed / 2**20:.1f} MB/s (Esc to cancel)")
+
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            # Closing the generator drops the pending writes, only complete files are left
+            self.steps.close()
+            self.stop(context)
+            self.report({'WARNING'}, "Export cancelled.")
+            return {'CANCELLED'}
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        deadline = time.perf_counter() + self.TICK_DURATION
+        try:
+            while time.perf_counter() < deadline:
+                self.progress = next(self.steps)
+        except StopIteration:
+            self.stop(context)
+            return self.finish()
+        except Exception as e:
+            # The export cleaned up its partial files, end the operator instead of raising out of modal
+            self.stop(context)
+            self.report({'ERROR'}, f"Export failed: {e!r}")
+            return {'CANCELLED'}
+        context.workspace.status_text_set(self.status())
+        return {'RUNNING_MODAL'}
+
 class RendererRenderSettingsPanel(bpy.types.Panel):
     """Creates a MTI Renderer settings panel in the render context of the properties editor"""
     bl_label = "MTI Render settings"
@@ -71,6 +131,8 @@ class RendererRenderSettingsPanel(bpy.types.Panel):
         row = layout.row()
         row.prop(scene, "batch_frame_start")
         row.prop(scene, "batch_frame_end")
+        row = layout.row()
+        row.prop(scene, "export_animation")
 
         layout.label(text="Resolution:")
         row = layout.row()
@@ -104,9 +166,56 @@ class RendererRenderSettingsPanel(bpy.types.Panel):
         row = layout.row()
         layout.prop(scene, "reexport_geometry")
         row = layout.row()
+        layout.prop(scene, "prune_meshes")
+        row = layout.row()
+        layout.prop(scene, "mesh_format")
+        if scene.mesh_format == "compressed":
+            row = layout.row()
+            layout.prop(scene, "position_bits")
+        row = layout.row()
+        layout.prop(scene, "export_bvh")
+        row = layout.row()
+        layout.prop(scene, "export_emitters")
+        row = layout.row()
+        layout.prop(scene, "share_geometry")
+        row = layout.row()
+        layout.prop(scene, "export_instancers")
+        row = layout.row()
+        layout.prop(scene, "export_workers")
+        row = layout.row()
+        layout.prop(scene, "bake_textures")
+        row = layout.row()
+        layout.prop(scene, "texture_budget")
+        if scene.texture_budget == "memory":
+            row = layout.row()
+            layout.prop(scene, "texture_budget_mb")
+        if scene.texture_budget == "ratio":
+            row = layout.row()
+            layout.prop(scene, "texture_max_ratio")
+        row = layout.row()
+        layout.prop(scene, "compact_json")
+        row = layout.row()
+        layout.prop(scene, "verbose_log")
+        row = layout.row()
+        layout.prop(scene, "frustum_culling")
+        if scene.frustum_culling:
+            row = layout.row()
+            layout.prop(scene, "culling_margin")
+        row = layout.row()
+        layout.prop(scene, "lod_pixels")
+        if scene.lod_pixels > 0:
+            row = layout.row()
+            layout.prop(scene, "lod_mode")
+        row = layout.row()
         layout.prop(scene, "improved_principled")
         row = layout.row()
         layout.prop(scene, "envmap")
+        if scene.envmap:
+            row = layout.row()
+            layout.prop(scene, "envmap_sampling")
+            if scene.envmap_sampling:
+                row = layout.row()
+                layout.prop(scene, "envmap_sampling_resolution")
         
         row = layout.row()
         layout.operator("scene.export", icon='MESH_CUBE', text="Export scene")
@@ -127,11 +236,35 @@ def register():
     bpy.types.Scene.lensradius = bpy.props.FloatProperty(name = "Lens radius", description = "Lens radius", default = 0, min = 0.001, max = 9999)
     bpy.types.Scene.batch_frame_start = bpy.props.IntProperty(name = "Frame start", description = "Frame start", default = 1, min = 1, max = 9999999)
     bpy.types.Scene.batch_frame_end = bpy.props.IntProperty(name = "Frame end", description = "Frame end", default = 1, min = 1, max = 9999999)
+    bpy.types.Scene.export_animation = bpy.props.BoolProperty(name = "Animation tracks", description = "Export the first frame as the scene and the following frames as camera/shape tracks (animation.json)", default = False)
 
     bpy.types.Scene.export_normal_map = bpy.props.BoolProperty(name = "Export normal map", description = "Export normal map", default = False)
-    bpy.types.Scene.reexport_geometry = bpy.props.BoolProperty(name = "Reexport geometry", description = "Reexport geometry", default = True)
+    bpy.types.Scene.reexport_geometry = bpy.props.BoolProperty(name = "Reexport geometry", description = "Rewrite the meshes of every object (otherwise only the objects changed since the last export of the frame, see export_manifest.json)", default = True)
+    bpy.types.Scene.prune_meshes = bpy.props.BoolProperty(name = "Remove unused meshes", description = "Delete the mesh files of the previous exports that the exported frames do not use anymore", default = True)
+    mesh_formats = [("obj", "OBJ", "ASCII Wavefront OBJ", 1),("binary", "Binary", "Binary mesh (mmap-able arrays)", 2),("compressed", "Compressed", "Quantized and zlib compressed binary mesh", 3)]
+    bpy.types.Scene.mesh_format = bpy.props.EnumProperty(name = "Mesh format", description = "Mesh output format", items=mesh_formats, default="obj")
+    bpy.types.Scene.position_bits = bpy.props.IntProperty(name = "Position bits", description = "Bits per quantized position coordinate in compressed meshes (maximum error: half the bounding box size / (2^bits - 1), plus the float32 rounding)", default = 16, min = 8, max = 22)
+    bpy.types.Scene.export_bvh = bpy.props.BoolProperty(name = "Precompute BVH", description = "Build a binned SAH BVH per shape, order the triangles by leaf and write the nodes next to the mesh (.bvh)", default = False)
+    bpy.types.Scene.export_emitters = bpy.props.BoolProperty(name = "Emitter sampling", description = "Write the area CDF of the triangles of emissive shapes (.cdf) and a power table of the emitters per frame (lights/<frame>.emitters)", default = False)
+    bpy.types.Scene.export_instancers = bpy.props.BoolProperty(name = "Export instancers", description = "Export the instances of particle systems, geometry nodes and collection instances: each instanced mesh once and the instance matrices in a transform buffer (instances/<hash>.xform)", default = False)
+    bpy.types.Scene.share_geometry = bpy.props.BoolProperty(name = "Share geometry across frames", description = "Name meshes after their content so identical geometry is written once (meshes/shared, always on with Animation tracks)", default = True)
+    bpy.types.Scene.export_workers = bpy.props.IntProperty(name = "Export workers", description = "Number of threads writing the mesh files while objects are evaluated (0: write on the main thread)", default = 4, min = 0, max = 64)
+    bpy.types.Scene.bake_textures = bpy.props.BoolProperty(name = "Bake textures", description = "Export textures as pre-decoded, tiled and mipmapped files (.rtex)", default = False)
+    texture_budgets = [("none", "None", "Keep the textures at their source resolution", 1),("memory", "Memory", "Reduce the largest textures until the total decoded size fits the budget", 2),("ratio", "Screen ratio", "Reduce each texture to at most a number of texels per pixel covered on screen by its objects", 3)]
+    bpy.types.Scene.texture_budget = bpy.props.EnumProperty(name = "Texture budget", description = "Write reduced copies (halved resolutions) of the textures over the budget", items=texture_budgets, default="none")
+    bpy.types.Scene.texture_budget_mb = bpy.props.FloatProperty(name = "Texture memory (MB)", description = "Total decoded size of the image textures of the scene", default = 4096, min = 1, max = 2**20)
+    bpy.types.Scene.texture_max_ratio = bpy.props.FloatProperty(name = "Texels per pixel", description = "Largest texture side allowed per pixel of the projected size of the objects using it (at the first exported frame)", default = 1.0, min = 0.01, max = 64)
+    bpy.types.Scene.compact_json = bpy.props.BoolProperty(name = "Compact scene file", description = "Write the scene JSON without indentation and whitespace", default = False)
+    bpy.types.Scene.verbose_log = bpy.props.BoolProperty(name = "Verbose log", description = "Report every exported object, file and texture (slow for large scenes)", default = False)
+    bpy.types.Scene.frustum_culling = bpy.props.BoolProperty(name = "Frustum culling", description = "Skip the objects whose bounding box is fully outside of the camera frustum", default = False)
+    bpy.types.Scene.culling_margin = bpy.props.FloatProperty(name = "Culling margin", description = "Enlarge the camera field of view by this fraction before culling", default = 0.1, min = 0, max = 10)
+    bpy.types.Scene.lod_pixels = bpy.props.FloatProperty(name = "Minimum screen size", description = "Objects whose projected size is below this number of pixels are skipped or decimated (0: disabled)", default = 0, min = 0, max = 9999)
+    lod_modes = [("skip", "Skip", "Do not export small objects", 1),("decimate", "Decimate", "Export small objects with about one vertex per pixel (vertex clustering)", 2)]
+    bpy.types.Scene.lod_mode = bpy.props.EnumProperty(name = "Small objects", description = "What to do with the objects below the minimum screen size", items=lod_modes, default="skip")
     bpy.types.Scene.improved_principled = bpy.props.BoolProperty(name = "Improved Principled", description = "Improved Principled export", default = False)
     bpy.types.Scene.envmap = bpy.props.BoolProperty(name = "Export envmap", description = "Export envmap", default = False)
+    bpy.types.Scene.envmap_sampling = bpy.props.BoolProperty(name = "Envmap sampling tables", description = "Precompute the importance sampling distribution of the envmap (luminance x sin theta) next to the copied texture (.envcdf)", default = False)
+    bpy.types.Scene.envmap_sampling_resolution = bpy.props.IntProperty(name = "Sampling resolution", description = "Width of the envmap sampling grid (its height is half of it, both at most the image size)", default = 1024, min = 16, max = 16384)
     
     integrators = [("path", "path", "", 1),("normal", "normal", "", 2),("ao", "ao", "", 3)]
     bpy.types.Scene.integrators = bpy.props.EnumProperty(name = "Name", items=integrators , default="path")
@@ -0,0 +1,72 @@
+import json
+
+class ListWriter:
+    """JSON list written item by item (optionally keeping the items)"""
+
+    def __init__(self, writer, keep):
+        self.writer = writer
+        self.items = [] if keep else None
+        self.count = 0
+
+    def append(self, item):
+        self.writer.list_item(self.count, item)
+        self.count += 1
+        if self.items is not None:
+            self.items.append(item)
+
+    def __len__(self):
+        return self.count
+
+class SceneWriter:
+    """Write the scene JSON object incrementally
+    (the indented output matches json.dumps(data, indent=4), compact drops all whitespace)"""
+
+    def __init__(self, out, compact=False):
+        self.out = out
+        self.compact = compact
+        self.nb_keys = 0
+        self.current_list = None
+        self.out.write("{")
+
+    def dumps(self, value, depth):
+        if self.compact:
+            return json.dumps(value, separators=(",", ":"))
+        return json.dumps(value, indent=4).replace("\n", "\n" + "    " * depth)
+
+    def key(self, key):
+        separator = "," if self.nb_keys != 0 else ""
+        if self.compact:
+            self.out.write(f'{separator}{json.dumps(key)}:')
+        else:
+            self.out.write(f'{separator}\n    {json.dumps(key)}: ')
+        self.nb_keys += 1
+
+    def write(self, key, value):
+        """Write a complete top-level value"""
+        self.key(key)
+        self.out.write(self.dumps(value, 1))
+
+    def begin_list(self, key, keep=False):
+        """Start a top-level list, return the object receiving its items"""
+        self.key(key)
+        self.out.write("[")
+        self.current_list = ListWriter(self, keep)
+        return self.current_list
+
+    def list_item(self, index, item):
+        separator = "," if index != 0 else ""
+        if self.compact:
+            self.out.write(separator + self.dumps(item, 2))
+        else:
+            self.out.write(separator + "\n        " + self.dumps(item, 2))
+
+    def end_list(self):
+        if self.current_list.count != 0 and not self.compact:
+            self.out.write("\n    ")
+        self.out.write("]")
+        self.current_list = None
+
+    def close(self):
+        if self.nb_keys != 0 and not self.compact:
+            self.out.write("\n")
+        self.out.write("}")
@@ -0,0 +1,105 @@
+import struct
+import numpy as np
+
+# Baked texture layout (little-endian):
+#   header: magic, version, pixel format, channels, width, height, tile size, level count
+#   level table: width, height, byte offset of each mip level
+#   levels: tiles in row-major order, each tile TILE_SIZE x TILE_SIZE texels (edge tiles are padded
+#           by repeating the last row/column), rows stored top to bottom
+# Levels start on a BAKED_ALIGNMENT boundary so they can be mmap-ed directly.
+BAKED_MAGIC = b"MTITEX\0\0"
+BAKED_VERSION = 1
+BAKED_HEADER = struct.Struct("<8sIIIIIII")
+BAKED_LEVEL = struct.Struct("<IIQ")
+BAKED_ALIGNMENT = 64
+BAKED_EXTENSION = ".rtex"
+TILE_SIZE = 64
+
+# Pixel formats
+FORMAT_UNORM8 = 0
+FORMAT_FLOAT16 = 1
+
+def srgb_to_linear(c):
+    return np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+
+def linear_to_srgb(c):
+    return np.where(c <= 0.0031308, c * 12.92, 1.055 * np.power(np.maximum(c, 0.0031308), 1.0 / 2.4) - 0.055)
+
+def downsample(level):
+    """Box filter a (height, width, channels) level to half its size"""
+    (height, width, _) = level.shape
+    if height > 1 and height % 2 == 1:
+        level = np.concatenate((level, level[-1:]), axis=0)
+    if width > 1 and width % 2 == 1:
+        level = np.concatenate((level, level[:, -1:]), axis=1)
+    if height > 1:
+        level = 0.5 * (level[0::2] + level[1::2])
+    if width > 1:
+        level = 0.5 * (level[:, 0::2] + level[:, 1::2])
+    return level
+
+def reduce_pixels(pixels, width, height, gamma):
+    """Downsample a (height, width, channels) float image until it is at most width x height
+    (filtered in linear space when the values are sRGB encoded)"""
+    level = srgb_to_linear(pixels) if gamma else pixels
+    while level.shape[1] > width or level.shape[0] > height:
+        level = downsample(level)
+    return linear_to_srgb(level) if gamma else level
+
+def build_mips(pixels, gamma):
+    """Return the mip chain of a (height, width, channels) float image
+    (filtered in linear space when the values are sRGB encoded)"""
+    level = srgb_to_linear(pixels) if gamma else pixels
+    levels = [level]
+    while level.shape[0] > 1 or level.shape[1] > 1:
+        level = downsample(level)
+        levels.append(level)
+    if gamma:
+        levels = [pixels] + [linear_to_srgb(l) for l in levels[1:]]
+    return levels
+
+def tile_level(level):
+    """Reorder a (height, width, channels) level into TILE_SIZE x TILE_SIZE tiles"""
+    (height, width, channels) = level.shape
+    tiles_y = -(-height // TILE_SIZE)
+    tiles_x = -(-width // TILE_SIZE)
+    level = np.pad(level, ((0, tiles_y * TILE_SIZE - height), (0, tiles_x * TILE_SIZE - width), (0, 0)), mode="edge")
+    level = level.reshape(tiles_y, TILE_SIZE, tiles_x, TILE_SIZE, channels)
+    return np.ascontiguousarray(level.transpose(0, 2, 1, 3, 4))
+
+def encode(level, pixel_format):
+    if pixel_format == FORMAT_UNORM8:
+        return np.round(np.clip(level, 0.0, 1.0) * 255.0).astype(np.uint8)
+    return level.astype("<f2")
+
+def write_baked_texture(file, pixels, gamma, pixel_format):
+    """Write the mipmapped and tiled version of a (height, width, channels) float image stored top to bottom"""
+    levels = [encode(tile_level(level), pixel_format) for level in build_mips(pixels, gamma)]
+    (height, width, channels) = pixels.shape
+
+    align = lambda offset: (offset + BAKED_ALIGNMENT - 1) // BAKED_ALIGNMENT * BAKED_ALIGNMENT
+    offsets = []
+    offset = align(BAKED_HEADER.size + BAKED_LEVEL.size * len(levels))
+    for level in levels:
+        offsets.append(offset)
+        offset = align(offset + level.nbytes)
+
+    with open(file, 'wb') as out:
+        out.write(BAKED_HEADER.pack(BAKED_MAGIC, BAKED_VERSION, pixel_format, channels,
+            width, height, TILE_SIZE, len(levels)))
+        (level_width, level_height) = (width, height)
+        for offset in offsets:
+            out.write(BAKED_LEVEL.pack(level_width, level_height, offset))
+            (level_width, level_height) = (max(1, (level_width + 1) // 2), max(1, (level_height + 1) // 2))
+        for (level, offset) in zip(levels, offsets):
+            out.write(b"\0" * (offset - out.tell()))
+            out.write(level.tobytes())
+
+def image_pixels(image):
+    """Return the pixels of a bpy image as a (height, width, channels) float array stored top to bottom"""
+    (width, height) = image.size
+    channels = image.channels
+    pixels = np.empty(width * height * channels, dtype=np.float32)
+    image.pixels.foreach_get(pixels)
+    # Blender stores the rows bottom to top
+    return pixels.reshape(height, width, channels)[::-1]
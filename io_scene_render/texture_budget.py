@@ -0,0 +1,48 @@
+import heapq
+
+# Textures are never reduced below this size (largest side, in texels)
+MIN_TEXTURE_SIZE = 16
+
+def texture_bytes(width, height, channels, is_float):
+    """Decoded size of the full resolution level"""
+    return width * height * channels * (4 if is_float else 1)
+
+def halve(size):
+    """Size of the next mip level (same rounding as texture_bake.downsample)"""
+    (width, height) = size
+    return (max(1, (width + 1) // 2), max(1, (height + 1) // 2))
+
+def plan_budget(textures, budget_bytes=None):
+    """Choose the resolution of each texture, halving it until it fits its limits
+
+    textures: {key : {"size", "channels", "is_float", "max_size" (largest side allowed, None: unlimited)}}
+    budget_bytes: limit of the total decoded size, the largest textures are reduced first.
+    Return {key : (width, height, reason)} for every texture (reason is None when kept at full resolution).
+    """
+    plan = {}
+    for (key, texture) in textures.items():
+        size = tuple(texture["size"])
+        reason = None
+        max_size = texture.get("max_size")
+        if max_size is not None:
+            while max(size) > max(max_size, MIN_TEXTURE_SIZE):
+                size = halve(size)
+                reason = "ratio"
+        plan[key] = (size[0], size[1], reason)
+
+    if budget_bytes is not None:
+        size_of = lambda key, size: texture_bytes(size[0], size[1], textures[key]["channels"], textures[key]["is_float"])
+        total = sum(size_of(key, plan[key][:2]) for key in plan)
+        # Largest first (ties broken by key for a deterministic plan)
+        heap = [(-size_of(key, plan[key][:2]), key) for key in sorted(plan)]
+        heapq.heapify(heap)
+        while total > budget_bytes and len(heap) != 0:
+            (_, key) = heapq.heappop(heap)
+            size = plan[key][:2]
+            if max(size) <= MIN_TEXTURE_SIZE:
+                continue
+            reduced = halve(size)
+            total -= size_of(key, size) - size_of(key, reduced)
+            plan[key] = (reduced[0], reduced[1], "memory")
+            heapq.heappush(heap, (-size_of(key, reduced), key))
+    return plan
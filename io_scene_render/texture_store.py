@@ -0,0 +1,215 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from . import mesh_export
+from . import texture_bake
+from . import light_sampling
+from . import export_metrics
+
+# Textures bigger than this are copied in the background
+LARGE_TEXTURE = 4 * 2**20
+COPY_WORKERS = 4
+# Background jobs waiting or running at once (each baking job holds the pixels of its image)
+PENDING_JOBS = 2 * COPY_WORKERS
+MANIFEST = "manifest.json"
+
+# Opened stores (output texture directory -> TextureStore)
+stores = {}
+
+def file_hash(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def copy_file(source, destination):
+    """Copy through a temporary file so an interrupted copy never leaves a partial texture"""
+    tmp = mesh_export.temporary_path(destination)
+    shutil.copyfile(source, tmp)
+    os.replace(tmp, destination)
+
+def write_baked(destination, pixels, gamma, pixel_format, size=None):
+    tmp = mesh_export.temporary_path(destination)
+    if size is not None:
+        pixels = texture_bake.reduce_pixels(pixels, size[0], size[1], gamma)
+    texture_bake.write_baked_texture(tmp, pixels, gamma, pixel_format)
+    os.replace(tmp, destination)
+
+def write_envmap_distribution(destination, pixels, width, height, gamma):
+    weights = light_sampling.envmap_weights(pixels, width, height, gamma)
+    light_sampling.write_envmap_distribution(destination, weights)
+
+class TextureStore:
+    """Content addressed texture directory: each unique image is stored once as <name>_<hash><ext>.
+    The manifest remembers the size and mtime of every source so unchanged textures are not read again."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, MANIFEST)
+        self.sources = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.sources = json.load(f)
+        self.files = {entry["hash"] : entry["file"] for entry in self.sources.values()}
+        self.pending = set()
+        self.copies = []
+        self.executor = None
+        self.slots = threading.BoundedSemaphore(PENDING_JOBS)
+
+    def resolve(self, source):
+        """Return the manifest entry of the source, hashing it only if it is new or modified"""
+        source = os.path.realpath(source)
+        stat = os.stat(source)
+        entry = self.sources.get(source)
+        if entry is None or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime_ns:
+            # New or modified source: fall back to the content hash
+            digest = file_hash(source)
+            if digest not in self.files:
+                (stem, ext) = os.path.splitext(os.path.basename(source))
+                self.files[digest] = f"{stem}_{digest[:16]}{ext}"
+            entry = {
+                "size" : stat.st_size,
+                "mtime" : stat.st_mtime_ns,
+                "hash" : digest,
+                "file" : self.files[digest]
+            }
+            self.sources[source] = entry
+        return entry
+
+    def add(self, parent, source):
+        """Store the source image, return its file name inside the texture directory"""
+        source = os.path.realpath(source)
+        stat = os.stat(source)
+        entry = self.resolve(source)
+
+        name = entry["file"]
+        destination = os.path.join(self.directory, name)
+        if name in self.pending:
+            return name
+        if os.path.exists(destination) and os.stat(destination).st_nlink == 1:
+            export_metrics.log(parent, f"Texture unchanged: {source}")
+            return name
+        self.pending.add(name)
+
+        # Always a copy: a hardlink (left by older exports) would follow in-place edits of the source
+        # and the file would not match its hash anymore
+        export_metrics.log(parent, f"Copying texture: {source} to {destination}")
+        if stat.st_size < LARGE_TEXTURE:
+            copy_file(source, destination)
+        else:
+            self.submit(copy_file, source, destination)
+        return name
+
+    def bake(self, parent, image, source, gamma, size=None):
+        """Store the mipmapped and tiled version of the image (downsampled to size if given),
+        return its file name inside the texture directory"""
+        entry = self.resolve(source)
+        stem = os.path.splitext(entry["file"])[0] + (f"_{size[0]}x{size[1]}" if size is not None else "")
+        name = stem + ("" if gamma else "_linear") + texture_bake.BAKED_EXTENSION
+        destination = os.path.join(self.directory, name)
+        if name in self.pending or os.path.exists(destination):
+            export_metrics.log(parent, f"Baked texture unchanged: {source}")
+            return name
+        self.pending.add(name)
+
+        # Pixel access has to stay on the main thread, the conversion runs in the background
+        export_metrics.log(parent, f"Baking texture: {source} to {destination}")
+        pixel_format = texture_bake.FORMAT_FLOAT16 if image.is_float else texture_bake.FORMAT_UNORM8
+        self.submit_pixels(write_baked, destination, image, gamma, pixel_format, size)
+        return name
+
+    def resize(self, parent, source, size, save):
+        """Store a resized copy of the image, written by save(path, width, height) on the calling thread,
+        return its file name inside the texture directory"""
+        entry = self.resolve(source)
+        (stem, ext) = os.path.splitext(entry["file"])
+        name = f"{stem}_{size[0]}x{size[1]}{ext}"
+        destination = os.path.join(self.directory, name)
+        if name in self.pending or os.path.exists(destination):
+            export_metrics.log(parent, f"Resized texture unchanged: {source}")
+            return name
+        self.pending.add(name)
+
+        export_metrics.log(parent, f"Resizing texture: {source} to {destination} ({size[0]}x{size[1]})")
+        tmp = mesh_export.temporary_path(destination)
+        save(tmp, size[0], size[1])
+        os.replace(tmp, destination)
+        return name
+
+    def envmap_distribution(self, parent, image, source, width, height):
+        """Store the importance sampling distribution of an envmap over a height x width grid
+        (at most the image size), return its file name inside the texture directory"""
+        entry = self.resolve(source)
+        (width, height) = (min(width, image.size[0]), min(height, image.size[1]))
+        name = light_sampling.envmap_filename(entry["file"], width, height)
+        destination = os.path.join(self.directory, name)
+        if name in self.pending or os.path.exists(destination):
+            export_metrics.log(parent, f"Envmap distribution unchanged: {source}")
+            return name
+        self.pending.add(name)
+
+        # Same as baking: the pixels are read on the main thread, the tables are built in the background
+        export_metrics.log(parent, f"Building envmap distribution: {source} to {destination} ({width}x{height})")
+        self.submit_pixels(write_envmap_distribution, destination, image, width, height, not image.is_float)
+        return name
+
+    def submit(self, fn, *args):
+        """Run fn(*args) in the background (waits while PENDING_JOBS jobs are pending)"""
+        self.slots.acquire()
+        self.start(fn, args)
+
+    def submit_pixels(self, fn, destination, image, *args):
+        """Read the pixels of the image and run fn(destination, pixels, *args) in the background
+        (the pixels are only read once a slot is free, so at most PENDING_JOBS images are held)"""
+        self.slots.acquire()
+        try:
+            pixels = texture_bake.image_pixels(image)
+        except BaseException:
+            self.slots.release()
+            raise
+        self.start(fn, (destination, pixels, *args))
+
+    def start(self, fn, args):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=COPY_WORKERS, thread_name_prefix="io_scene_render_textures")
+        self.copies.append(self.executor.submit(self.run, fn, args))
+
+    def run(self, fn, args):
+        try:
+            fn(*args)
+        finally:
+            self.slots.release()
+
+    def close(self):
+        """Wait for the background copies and save the manifest"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            for copy in self.copies:
+                copy.result()
+        # Merge with the entries saved meanwhile by other exports (e.g. batch worker processes)
+        sources = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                sources = json.load(f)
+        sources.update(self.sources)
+        tmp = mesh_export.temporary_path(self.manifest_path)
+        with open(tmp, 'w') as f:
+            json.dump(sources, f, indent=4)
+        os.replace(tmp, self.manifest_path)
+
+def open_store(directory):
+    directory = os.path.realpath(directory)
+    if directory not in stores:
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        stores[directory] = TextureStore(directory)
+    return stores[directory]
+
+def close_store(directory):
+    store = stores.pop(os.path.realpath(directory), None)
+    if store is not None:
+        store.close()